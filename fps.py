@@ -6,10 +6,73 @@
 
 ####
 
+import collections
 import pygame
 
 ####
 
+class TextCache(object):
+    """Rendered text surfaces, kept in a LRU cache per font, text, colors and antialiasing.
+    """
+    def __init__(self, max_surfaces=64):
+
+        self.surfaces = collections.OrderedDict()
+        self.max_surfaces = max_surfaces
+
+
+    def render(self, font, text, color, antialias=True, background=None):
+
+        key = font, text, tuple(color), antialias, background and tuple(background)
+        surface = self.surfaces.pop(key, None)
+        if surface is None:
+            surface = font.render(text, antialias, color, background)
+            if len(self.surfaces) >= self.max_surfaces:
+                self.surfaces.popitem(last=False)
+        self.surfaces[key] = surface
+        return surface
+
+####
+
+class GlyphAtlas(object):
+    """Characters rendered once side by side on one surface,
+    texts of these characters are drawn by a blit per character.
+    With a background color the blits are opaque and faster.
+    """
+    def __init__(self, font, color, chars="0123456789.-+ ", antialias=True, background=None):
+
+        glyphs = [font.render(char, antialias, color, background) for char in chars]
+        self.height = max(glyph.get_height() for glyph in glyphs)
+        size = sum(glyph.get_width() for glyph in glyphs), self.height
+        if background is None:
+            self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        else:
+            self.surface = pygame.Surface(size).convert()
+            self.surface.fill(background)
+        self.areas = {}
+        x = 0
+        for char, glyph in zip(chars, glyphs):
+            self.surface.blit(glyph, (x, 0))
+            self.areas[char] = pygame.Rect(x, 0, glyph.get_width(), self.height)
+            x += glyph.get_width()
+
+
+    def size(self, text):
+
+        return sum(self.areas[char].width for char in text), self.height
+
+
+    def draw(self, surface, text, pos):
+        """Blit text at pos, return the x after it.
+        """
+        x, y = pos
+        for char in text:
+            area = self.areas[char]
+            surface.blit(self.surface, (x, y), area)
+            x += area.width
+        return x
+
+####
+
 class PygView(object):
 
 
@@ -26,6 +89,10 @@ class PygView(object):
         self.clock = pygame.time.Clock()
         self.playtime = 0.0
         self.font = pygame.font.SysFont('mono', self.height // 7, bold=True)
+        self.color = 0, 255, 0
+        self.back_color = 0, 0, 0
+        self.texts = TextCache()
+        self.digits = GlyphAtlas(self.font, self.color, background=self.back_color)
 
 
     def run(self):
@@ -42,8 +109,8 @@ class PygView(object):
 
             milliseconds = self.clock.tick(self.fps)
             self.playtime += milliseconds / 1000.0
-            self.draw_text("FPS: %6.3f%sPLAYTIME: %6.3f SECONDS" %
-                           (self.clock.get_fps(), " "*5, self.playtime))
+            self.draw_readout(("FPS: ", "%6.3f" % self.clock.get_fps(),
+                               " "*5 + "PLAYTIME: ", "%6.3f" % self.playtime, " SECONDS"))
 
             self.flip()
 
@@ -55,16 +122,32 @@ class PygView(object):
         pygame.display.flip()
         self.clock.tick(self.fps)
         #self.screen.blit(self.background, (0, 0))
-        self.screen.fill((0, 0, 0))
+        self.screen.fill(self.back_color)
 
 
     def draw_text(self, text):
         """Center text in window.
         """
-        fw, fh = self.font.size(text)
-        surface = self.font.render(text, True, (0, 255, 0))
+        surface = self.texts.render(self.font, text, self.color)
+        fw, fh = surface.get_size()
         self.screen.blit(surface, ((self.width - fw) // 2, (self.height - fh) // 2))
 
+
+    def draw_readout(self, parts):
+        """Center a line of alternating labels and numbers in window,
+        the labels from the text cache, the numbers from the glyph atlas.
+        """
+        labels = [self.texts.render(self.font, label, self.color, background=self.back_color)
+                  for label in parts[::2]]
+        numbers = parts[1::2]
+        fw = (sum(label.get_width() for label in labels) +
+              sum(self.digits.size(number)[0] for number in numbers))
+        fh = max(label.get_height() for label in labels)
+        x, y = (self.width - fw) // 2, (self.height - fh) // 2
+        for label, number in zip(labels, numbers + ("",)):
+            self.screen.blit(label, (x, y))
+            x = self.digits.draw(self.screen, number, (x + label.get_width(), y))
+
 ####
 
 if __name__ == '__main__':
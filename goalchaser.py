@@ -89,7 +89,8 @@ class PygView(object):
         running = True
         while running:
             pyg.display.set_caption("Press ESC to exit."
-                                    "{}{:1.4f}".format(" " * 8, self.frame_duration_secs))
+                                    "{}{:1.4f}{}".format(" " * 8, self.frame_duration_secs,
+                                                         self.controller.timing()))
             #self.clock.tick_busy_loop(self.fps)
             self.clock.tick(self.fps)
             running = self.dispatch_events()
@@ -146,13 +147,14 @@ class Shape(object):
         self.act_coords = list(coords[:])
         self.color = color
         self.pos = 0.0, 0.0
+        self.prev_pos = self.pos
         self.alpha = 0
         self.dxy = 0.0, 0.0
 
 
     def translate_abs(self, tx, ty):
 
-        self.pos = tx, ty
+        self.pos = self.prev_pos = tx, ty
 
 
     def translate_rel(self, tx, ty):
@@ -168,15 +170,15 @@ class Shape(object):
             self.alpha -= PI2
 
 
-    def draw(self, device, color=None):
-        """Tranform and draw.
+    def draw(self, device, color=None, pos=None):
+        """Tranform and draw, at pos if given.
         """
         # Get complex number as rotation vector
         alpha_z = alpha_to_z(self.alpha)
         # Rotate points which are specified in definition space.
         rot_pts = [complex(*pt) * alpha_z for pt in self.coords]
         # Translate
-        tx, ty = self.pos
+        tx, ty = pos or self.pos
         coords = [(x + tx, y + ty) for x, y in [(z.real, z.imag) for z in rot_pts]]
 
         # Draw
@@ -264,6 +266,7 @@ class Robot(Shape):
 
     def move(self, dt, goal_pos):
 
+        self.prev_pos = self.pos
         self.orientate(dt, goal_pos)
         self.translate(dt, goal_pos)
         #pyg.time.delay(5)
@@ -292,7 +295,7 @@ class Simulation(object):
         self.robot = Robot(((20, 0), (-20, 20), (0, 0), (-20, -20)), conf)
         self.goal.random_trans(*self.area)
         self.robot.translate_abs(self.width // 2, self.height // 2)
-        self.dtimer = IntegrationTimer(conf['dt'])
+        self.dtimer = IntegrationTimer(conf['dt'], conf['max_steps'], conf['leftover'])
 
 
     def process(self):
@@ -305,7 +308,16 @@ class Simulation(object):
         self.dtimer += self.view.frame_duration_secs
         self.dtimer.integrate(self.robot.move, self.goal.pos)
         self.goal.draw(self.view)
-        self.robot.draw(self.view)
+        # draw between the last two steps, as far as the time left over reaches
+        (x0, y0), (x1, y1), alpha = self.robot.prev_pos, self.robot.pos, self.dtimer.alpha
+        self.robot.draw(self.view, pos=(x0 + alpha * (x1 - x0), y0 + alpha * (y1 - y0)))
+
+
+    def timing(self):
+        """Worst frame, its steps and clamped time for the caption.
+        """
+        return "{}worst {:1.4f} ({} steps)  clamped {:1.2f}".format(
+            " " * 8, self.dtimer.worst_frame, self.dtimer.worst_steps, self.dtimer.clamped)
 
 
     def run(self):
@@ -316,26 +328,53 @@ class Simulation(object):
 
 class IntegrationTimer(object):
     """Fix your timestep. ;-)
+
+    At most max_steps steps per frame, so a slow frame can't start a spiral of death.
     """
-    def __init__(self, dt):
+    def __init__(self, dt, max_steps=10, leftover='drop'):
         """Set calculation step per second.
+
+        leftover: what to do with whole steps that couldn't catch up,
+        'drop' them (the simulation falls behind) or 'carry' them to the next frames.
         """
+        assert leftover in ('drop', 'carry'), "unknown leftover policy"
         self.dt = dt
         self.accu = 0.0
+        self.max_steps = max_steps
+        self.leftover = leftover
+        self.alpha = 0.0
+        self.clamped = 0.0
+        self.worst_frame = 0.0
+        self.frames = 0
+        self.steps = 0
+        self.worst_steps = 0
 
 
     def __iadd__(self, delta):
         """Update with elapsed time.
         """
         self.accu += delta
+        self.frames += 1
+        self.worst_frame = max(self.worst_frame, delta)
         return self
 
 
     def integrate(self, func, *args):
         """Execute func in accumulated time with step dt."""
-        while self.accu >= self.dt:
+        steps = 0
+        while self.accu >= self.dt and steps < self.max_steps:
             func(self.dt, *args)
             self.accu -= self.dt
+            steps += 1
+        self.steps += steps
+        self.worst_steps = max(self.worst_steps, steps)
+
+        if self.accu >= self.dt and self.leftover == 'drop':
+            # keep the part of a step for alpha
+            keep = self.accu - self.dt * int(self.accu / self.dt)
+            self.clamped += self.accu - keep
+            self.accu = keep
+        self.alpha = min(self.accu / self.dt, 1.0)
 
 ####
 
@@ -346,6 +385,8 @@ CONFIG = {'width': 900,
           'goal_col': (255, 0, 0),
           'fps': 200,        # Pygame clock ticks
           'dt': 0.005,       # Time delta in secs
+          'max_steps': 10,   # Steps per frame at most
+          'leftover': 'drop', # Steps that can't catch up: 'drop' or 'carry'
           'pi_step': 2,      # PI domain: angle = PI * 2 / pi_step
           'pi_eps': 32,     # PI domain: angle epsilon = PI * 2 / pi_eps
           'move_step': 128,   # screen domain
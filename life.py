@@ -4,9 +4,23 @@
 
 ####
 
+import os
+import sys
+import time
+import tempfile
+import collections
+import hashlib
+import threading
+import multiprocessing
 import pygame
 import random
 
+try:
+    import numpy as np
+    from multiprocessing import shared_memory
+except ImportError:
+    np = None
+
 ####
 
 WIDTH = 900
@@ -19,6 +33,17 @@ MAX_Y = HEIGHT // CELL_HEIGHT
 
 OFFSETS = ((0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1))
 CELL_COLOR = (0, 255, 0)
+BACK_COLOR = (20, 20, 20)
+
+# generations per frame for hashlife
+HASHLIFE_STEP = 16
+# cells per side of a ChunkedLife tile
+CHUNK = 64
+
+RULES = {'life': 'B3/S23',
+         'highlife': 'B36/S23',
+         'seeds': 'B2/S',
+         'daynight': 'B3678/S34678'}
 
 ####
 
@@ -33,23 +58,31 @@ def init_pygame(width, height):
 
 ####
 
-def populate_cells(max_x, max_y, ratio=8):
-    """Initialize cells at random."""
+def populate_cells(max_x, max_y, ratio=8, seed=None):
+    """Initialize cells at random, one in ratio + 1 is living.
+
+    With numpy it's the board of populate_array(), so a seed gives
+    the same board for every engine.
+    """
+    if np is not None:
+        return array_to_cells(populate_array(max_x, max_y, ratio, seed))
+    rand = random.Random(seed).random
+    p = 1.0 / (ratio + 1)
     cells = {}
     for y in range(max_y):
         for x in range(max_x):
-            cells[x, y] = random.choice(([0] * ratio) + [1])
+            cells[x, y] = int(rand() < p)
 
     return cells
 
 ####
 
-def dead_or_alive(old_cells, x, y, new_cells):
+def dead_or_alive(old_cells, x, y, new_cells, max_x=MAX_X, max_y=MAX_Y):
     """Check Rules:
            dead cell   => living cell, if exactly 3 neighbors
            living cell => dead cell, if not 2 or 3 neighbors
     """
-    neighbors = sum(old_cells[(x+i) % MAX_X, (y+j) % MAX_Y] for i, j in OFFSETS)
+    neighbors = sum(old_cells[(x+i) % max_x, (y+j) % max_y] for i, j in OFFSETS)
 
     if old_cells[x, y] == 0:
         if neighbors == 3:
@@ -64,18 +97,1509 @@ def dead_or_alive(old_cells, x, y, new_cells):
 
 ####
 
-def simulate(screen, clock):
+def parse_rule(rule):
+    """Compile a Life-like rule in B/S notation ('B36/S23') or a name
+    from RULES into a lookup table: table[state][neighbors] is the new state.
+    """
+    rule = RULES.get(rule.lower(), rule)
+    try:
+        born, survive = rule.upper().split('/')
+        if born[:1] != 'B' or survive[:1] != 'S':
+            raise ValueError
+        born = set(int(n) for n in born[1:])
+        survive = set(int(n) for n in survive[1:])
+    except ValueError:
+        raise ValueError("rule {!r} is not in B/S notation".format(rule))
+    if (born | survive) - set(range(9)):
+        raise ValueError("rule {!r} has more than 8 neighbors".format(rule))
+
+    return (tuple(int(n in born) for n in range(9)),
+            tuple(int(n in survive) for n in range(9)))
+
+####
+
+def look_up(old_cells, x, y, new_cells, table, max_x=MAX_X, max_y=MAX_Y):
+    """Like dead_or_alive(), for the rule table of parse_rule()."""
+    x0, x1 = (x - 1) % max_x, (x + 1) % max_x
+    y0, y1 = (y - 1) % max_y, (y + 1) % max_y
+    neighbors = (old_cells[x0, y0] + old_cells[x, y0] + old_cells[x1, y0] +
+                 old_cells[x0, y] + old_cells[x1, y] +
+                 old_cells[x0, y1] + old_cells[x, y1] + old_cells[x1, y1])
+    new_cells[x, y] = table[old_cells[x, y]][neighbors]
+
+####
+
+def populate_array(max_x, max_y, ratio=8, seed=None):
+    """Initialize cells at random, as uint8 array indexed [y, x].
+
+    seed is a number or a numpy Generator, which is used as is.
+    """
+    cells = np.random.default_rng(seed).integers(0, ratio + 1, (max_y, max_x), np.uint8)
+    return np.equal(cells, 0, out=cells)
+
+####
+
+def array_to_cells(board):
+    """uint8 array indexed [y, x] to the dict of populate_cells()."""
+    max_y, max_x = board.shape
+    return dict(zip(((x, y) for y in range(max_y) for x in range(max_x)),
+                    board.ravel().tolist()))
+
+####
+
+def rle_runs(data, x, y):
+    """Decode a piece of RLE data (no whitespace) which ends with a tag,
+    starting at cell x, y.  Returns arrays of x, y and length of the living runs
+    and the x, y where the next piece starts."""
+    is_digit = (data >= 48) & (data <= 57)
+    tags = np.flatnonzero(~is_digit)
+    # counts: digits in front of each tag, 1 if there are none
+    digits = np.flatnonzero(is_digit)
+    owner = np.searchsorted(tags, digits)
+    values = (data[digits] - 48) * 10.0 ** (tags[owner] - digits - 1)
+    counts = np.bincount(owner, values, len(tags)).astype(np.int64)
+    counts[np.bincount(owner, minlength=len(tags)) == 0] = 1
+
+    chars = data[tags]
+    newline = chars == ord('$')
+    down = np.where(newline, counts, 0)
+    right = counts - down
+    ys = y + np.cumsum(down) - down
+    xs = np.cumsum(right) - right
+    # x restarts after every '$'
+    last_newline = np.maximum.accumulate(np.where(newline, np.arange(len(tags)), -1))
+    xs = np.where(last_newline < 0, x + xs, xs - xs[np.maximum(last_newline, 0)])
+
+    living = ~newline & (chars != ord('b')) & (chars != ord('.'))
+    if newline[-1]:
+        x, y = 0, ys[-1] + counts[-1]
+    else:
+        x, y = xs[-1] + counts[-1], ys[-1]
+
+    return xs[living], ys[living], counts[living], x, y
+
+####
+
+def pattern_runs(path, chunk_size=1 << 20):
+    """Read a pattern file in chunks, yield arrays of living runs (x, y, length).
+
+    Files ending with .rle are run length encoded, others are plaintext
+    ('.' dead, 'O' or '*' living, '!' comment lines).
+    """
+    with open(path, 'rb') as f:
+        if not path.lower().endswith('.rle'):
+            y = 0
+            for line in f:
+                if not line.startswith(b'!'):
+                    row = np.frombuffer(line, np.uint8)
+                    xs = np.flatnonzero((row == ord('O')) | (row == ord('*')))
+                    yield xs, np.full_like(xs, y), np.ones_like(xs)
+                    y += 1
+            return
+
+        line = f.readline()
+        while line.startswith(b'#') or line.lstrip().startswith(b'x'):
+            line = f.readline()
+        x = y = 0
+        data = np.frombuffer(line, np.uint8)
+        while True:
+            chunk = f.read(chunk_size)
+            data = np.concatenate((data, np.frombuffer(chunk, np.uint8)))
+            data = data[data > 32]
+            tags = np.flatnonzero((data < 48) | (data > 57))
+            stop = np.flatnonzero(data[tags] == ord('!'))
+            if stop.size or not chunk:
+                end = tags[stop[0]] if stop.size else len(data)
+                if end:
+                    yield rle_runs(data[:end], x, y)[:3]
+                return
+            if tags.size:
+                # digits after the last tag belong to the next chunk
+                xs, ys, lengths, x, y = rle_runs(data[:tags[-1] + 1], x, y)
+                yield xs, ys, lengths
+                data = data[tags[-1] + 1:]
+
+####
+
+def place_pattern(board, path, x0=0, y0=0):
+    """Set the living cells of a pattern file in board, wrapping around
+    its edges, with the upper left corner of the pattern at x0, y0."""
+    max_y, max_x = board.shape
+    for xs, ys, lengths in pattern_runs(path):
+        # one index per living cell
+        total = lengths.sum()
+        first = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        cells_x = np.repeat(xs, lengths) + np.arange(total) - first
+        board[(y0 + np.repeat(ys, lengths)) % max_y, (x0 + cells_x) % max_x] = 1
+
+    return board
+
+####
+
+def wrap_pad(cells, padded):
+    """Copy cells into the middle of padded and wrap the torus
+    around its one cell border."""
+    padded[1:-1, 1:-1] = cells
+    padded[0, 1:-1] = cells[-1]
+    padded[-1, 1:-1] = cells[0]
+    padded[:, 0] = padded[:, -2]
+    padded[:, -1] = padded[:, 1]
+
+####
+
+def count_neighbors(padded, neighbors, state_weight=0):
+    """Sum the 8 shifted views of padded into neighbors, in place.
+
+    With state_weight 9 the cell's own state is added 9 times,
+    which gives the index into a rule table of parse_rule().
+    """
+    h, w = neighbors.shape
+    if state_weight:
+        np.multiply(padded[1:-1, 1:-1], state_weight, out=neighbors)
+    else:
+        neighbors.fill(0)
+    for i, j in OFFSETS:
+        np.add(neighbors, padded[1+j:1+j+h, 1+i:1+i+w], out=neighbors)
+
+####
+
+def apply_rule(cells, neighbors, new_cells, scratch):
+    """Same rules as dead_or_alive(), for whole arrays:
+           3 neighbors                 => living cell
+           2 neighbors and living cell => living cell
+    """
+    np.equal(neighbors, 3, out=new_cells)
+    np.equal(neighbors, 2, out=scratch)
+    np.bitwise_and(scratch, cells, out=scratch)
+    np.bitwise_or(new_cells, scratch, out=new_cells)
+
+####
+
+def compile_table(rule):
+    """Rule table of parse_rule() flattened to 18 entries (9 * state + neighbors)
+    and compiled to ranges of living entries, or of the dead ones if they
+    are fewer: comparisons are faster than np.take for uint8 arrays.
+    None for B3/S23, which apply_rule() does faster."""
+    if rule is None or parse_rule(rule) == parse_rule(RULES['life']):
+        return None
+    flat = sum(parse_rule(rule), ())
+    invert = sum(flat) > 9
+    ranges = []
+    for i, alive in enumerate(flat):
+        if alive != invert:
+            if ranges and ranges[-1][1] == i - 1:
+                ranges[-1][1] = i
+            else:
+                ranges.append([i, i])
+
+    return invert, tuple((lo, hi - lo) for lo, hi in ranges)
+
+####
+
+def apply_table(indexes, new_cells, scratch, compiled):
+    """Compiled rule table for whole arrays, indexes from
+    count_neighbors(..., state_weight=9)."""
+    invert, ranges = compiled
+    if not ranges:
+        new_cells.fill(0)
+    for n, (lo, width) in enumerate(ranges):
+        out = scratch if n else new_cells
+        if width:
+            # lo <= i <= lo + width, wrapping around below lo
+            np.subtract(indexes, lo, out=out)
+            np.less_equal(out, width, out=out)
+        else:
+            np.equal(indexes, lo, out=out)
+        if n:
+            np.bitwise_or(new_cells, scratch, out=new_cells)
+    if invert:
+        np.bitwise_xor(new_cells, 1, out=new_cells)
+
+####
+
+class DictLife(object):
+    """The classic dict board, stepped cell by cell with dead_or_alive(),
+    or with look_up() for other rules."""
+
+    def __init__(self, max_x, max_y, ratio=8, cells=None, rule=None, seed=None):
+
+        self.max_x = max_x
+        self.max_y = max_y
+        self.cells = (populate_cells(max_x, max_y, ratio, seed) if cells is None
+                      else array_to_cells(cells))
+        self.table = None if rule is None else parse_rule(rule)
+
+
+    def step(self):
+
+        new_cells = {}
+        max_x, max_y, table = self.max_x, self.max_y, self.table
+        for y in range(max_y):
+            for x in range(max_x):
+                if table is None:
+                    dead_or_alive(self.cells, x, y, new_cells, max_x, max_y)
+                else:
+                    look_up(self.cells, x, y, new_cells, table, max_x, max_y)
+        self.cells = new_cells
+
+
+    def living(self):
+
+        return [xy for xy, alive in self.cells.items() if alive]
+
+
+    def board_bytes(self):
+        """Dict plus one key tuple per cell (states are cached small ints)."""
+        return sys.getsizeof(self.cells) + sum(sys.getsizeof(xy) for xy in self.cells)
+
+####
+
+class ActiveLife(object):
+    """Dict board which only checks cells next to last generation's changes.
+
+    Cells that did not change and have no changed neighbor
+    cannot change either.  Births and deaths of the last step
+    are kept for the PatchRenderer.
+    """
+    def __init__(self, max_x, max_y, ratio=8, cells=None, rule=None, seed=None):
+
+        self.max_x = max_x
+        self.max_y = max_y
+        self.cells = (populate_cells(max_x, max_y, ratio, seed) if cells is None
+                      else array_to_cells(cells))
+        self.table = None if rule is None else parse_rule(rule)
+        self.changed = set(self.cells)
+        self.births = []
+        self.deaths = []
+
+
+    def step(self):
+
+        max_x, max_y = self.max_x, self.max_y
+        candidates = set(self.changed)
+        for x, y in self.changed:
+            candidates.update(((x+i) % max_x, (y+j) % max_y) for i, j in OFFSETS)
+
+        cells, table = self.cells, self.table
+        new_cells = {}
+        for x, y in candidates:
+            if table is None:
+                dead_or_alive(cells, x, y, new_cells, max_x, max_y)
+            else:
+                look_up(cells, x, y, new_cells, table, max_x, max_y)
+
+        self.births = [xy for xy, alive in new_cells.items() if alive and not cells[xy]]
+        self.deaths = [xy for xy, alive in new_cells.items() if cells[xy] and not alive]
+        cells.update(new_cells)
+        self.changed = set(self.births)
+        self.changed.update(self.deaths)
+
+
+    def living(self):
+
+        return [xy for xy, alive in self.cells.items() if alive]
+
+
+    def board_bytes(self):
+
+        return (sys.getsizeof(self.cells) + sum(sys.getsizeof(xy) for xy in self.cells)
+                + sys.getsizeof(self.changed))
+
+####
+
+class ArrayLife(object):
+    """Numpy board (uint8, indexed [y, x]).
+
+    Neighbors are counted with whole array sums over a wrapped border,
+    and 2 preallocated boards are swapped every generation,
+    so a step does not allocate.
+    """
+    def __init__(self, max_x, max_y, ratio=8, cells=None, rule=None, seed=None):
+
+        if np is None:
+            raise RuntimeError("ArrayLife needs numpy")
+        self.max_x = max_x
+        self.max_y = max_y
+        self.table = compile_table(rule)
+        self.cells = populate_array(max_x, max_y, ratio, seed) if cells is None else cells
+        self.new_cells = np.zeros_like(self.cells)
+        self.padded = np.zeros((max_y + 2, max_x + 2), np.uint8)
+        self.neighbors = np.zeros_like(self.cells)
+        self.scratch = np.zeros_like(self.cells)
+
+
+    def step(self):
+
+        wrap_pad(self.cells, self.padded)
+        if self.table is None:
+            count_neighbors(self.padded, self.neighbors)
+            apply_rule(self.cells, self.neighbors, self.new_cells, self.scratch)
+        else:
+            count_neighbors(self.padded, self.neighbors, 9)
+            apply_table(self.neighbors, self.new_cells, self.scratch, self.table)
+        self.cells, self.new_cells = self.new_cells, self.cells
+
+
+    def living(self):
+
+        ys, xs = np.nonzero(self.cells)
+        return zip(xs.tolist(), ys.tolist())
+
+
+    def as_array(self):
+
+        return self.cells
+
+
+    def board_bytes(self):
+
+        return self.cells.nbytes
+
+####
+
+def full_adder(a, b, c):
+    """Add 3 bitboards bitwise, return sum and carry bits."""
+    a_b = a ^ b
+    return a_b ^ c, (a & b) | (a_b & c)
+
+####
+
+class BitLife(object):
+    """Bit packed board: 64 cells per uint64 word, each row an array of words.
+
+    Bit x % 64 of word x // 64 is cell x.  The 8 neighbors of all cells
+    in a word are added with full adders, so one step handles 64 cells
+    per bitwise operation.  Rows are stepped in bands, which keeps the
+    temporary bitboards small compared to the board itself.
     """
-    Check cells in old map and write results to new map.
+    BAND = 256
+
+    def __init__(self, max_x, max_y, ratio=8, cells=None, rule=None, seed=None):
+
+        if np is None:
+            raise RuntimeError("BitLife needs numpy")
+        self.max_x = max_x
+        self.max_y = max_y
+        self.table = None if rule is None else parse_rule(rule)
+        self.words = (max_x + 63) // 64
+        self.last_bit = np.uint64((max_x - 1) % 64)
+        self.last_mask = np.uint64((1 << ((max_x - 1) % 64 + 1)) - 1)
+        self.cells = np.zeros((max_y, self.words), '<u8')
+        self.new_cells = np.zeros_like(self.cells)
+        if cells is None:
+            cells = populate_array(max_x, max_y, ratio, seed)
+        for y0 in range(0, max_y, self.BAND):
+            self.cells[y0:y0 + self.BAND] = self.pack(cells[y0:y0 + self.BAND])
+
+
+    def pack(self, rows):
+        """uint8 rows indexed [y, x] to word rows."""
+        packed = np.zeros((len(rows), self.words * 8), np.uint8)
+        bits = np.packbits(rows, axis=1, bitorder='little')
+        packed[:, :bits.shape[1]] = bits
+        return packed.view('<u8')
+
+
+    def unpack(self, rows):
+        """Word rows to uint8 rows indexed [y, x]."""
+        bits = np.unpackbits(rows.view(np.uint8), axis=1, bitorder='little')
+        return bits[:, :self.max_x]
+
+
+    def west(self, rows):
+        """Every cell gets the state of its west neighbor (torus)."""
+        one, top = np.uint64(1), np.uint64(63)
+        shifted = rows << one
+        shifted[:, 1:] |= rows[:, :-1] >> top
+        shifted[:, 0] |= (rows[:, -1] >> self.last_bit) & one
+        shifted[:, -1] &= self.last_mask
+        return shifted
+
+
+    def east(self, rows):
+        """Every cell gets the state of its east neighbor (torus)."""
+        one, top = np.uint64(1), np.uint64(63)
+        shifted = rows >> one
+        shifted[:, :-1] |= rows[:, 1:] << top
+        shifted[:, -1] |= (rows[:, 0] & one) << self.last_bit
+        return shifted
+
+
+    def step_band(self, y0, y1):
+        """Rules of dead_or_alive() for rows y0 to y1, as adder logic:
+        count = ones + 2 * twos + 4 * more, alive if count is 3,
+        or 2 for a living cell.  Other rules get a mask per count."""
+        block = self.cells.take(np.arange(y0 - 1, y1 + 1), axis=0, mode='wrap')
+        west = self.west(block)
+        east = self.east(block)
+
+        s0, c0 = full_adder(west[:-2], block[:-2], east[:-2])
+        s1, c1 = full_adder(west[2:], block[2:], east[2:])
+        w, e = west[1:-1], east[1:-1]
+        ones, c2 = full_adder(s0, s1, w ^ e)
+        twos, c3 = full_adder(c0, c1, w & e)
+        carry = twos & c2
+        twos ^= c2
+        alive = block[1:-1]
+
+        if self.table is None:
+            self.new_cells[y0:y1] = twos & ~(c3 | carry) & (ones | alive)
+            return
+
+        bits = ones, twos, c3 ^ carry, c3 & carry
+        new_cells = np.zeros_like(alive)
+        for n in range(9):
+            if self.table[0][n] or self.table[1][n]:
+                mask = np.full_like(alive, ~np.uint64(0))
+                for k, b in enumerate(bits):
+                    mask &= b if n >> k & 1 else ~b
+                if not self.table[0][n]:
+                    mask &= alive
+                elif not self.table[1][n]:
+                    mask &= ~alive
+                new_cells |= mask
+        new_cells[:, -1] &= self.last_mask
+        self.new_cells[y0:y1] = new_cells
+
+
+    def step(self):
+
+        for y0 in range(0, self.max_y, self.BAND):
+            self.step_band(y0, min(y0 + self.BAND, self.max_y))
+        self.cells, self.new_cells = self.new_cells, self.cells
+
+
+    def living(self):
+
+        for y0 in range(0, self.max_y, self.BAND):
+            ys, xs = np.nonzero(self.unpack(self.cells[y0:y0 + self.BAND]))
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                yield x, y + y0
+
+
+    def as_array(self):
+
+        return self.unpack(self.cells)
+
+
+    def board_bytes(self):
+
+        return self.cells.nbytes
+
+####
+
+def band_worker(name, max_x, max_y, y0, y1, start, done, stop, rule=None):
+    """Step rows y0 to y1 of the shared boards, generation by generation.
+
+    Only the 2 halo rows above and below the band are read
+    from the other workers' bands."""
+    shm = shared_memory.SharedMemory(name=name)
+    boards = np.ndarray((2, max_y, max_x), np.uint8, buffer=shm.buf)
+    padded = np.zeros((y1 - y0 + 2, max_x + 2), np.uint8)
+    neighbors = np.zeros((y1 - y0, max_x), np.uint8)
+    scratch = np.zeros_like(neighbors)
+    table = compile_table(rule)
+    cells = None
+    current = 0
+    while True:
+        start.wait()
+        if stop.value:
+            break
+        cells = boards[current]
+        padded[1:-1, 1:-1] = cells[y0:y1]
+        padded[0, 1:-1] = cells[(y0 - 1) % max_y]
+        padded[-1, 1:-1] = cells[y1 % max_y]
+        padded[:, 0] = padded[:, -2]
+        padded[:, -1] = padded[:, 1]
+        if table is None:
+            count_neighbors(padded, neighbors)
+            apply_rule(cells[y0:y1], neighbors, boards[1 - current, y0:y1], scratch)
+        else:
+            count_neighbors(padded, neighbors, 9)
+            apply_table(neighbors, boards[1 - current, y0:y1], scratch, table)
+        current = 1 - current
+        done.wait()
+
+    del cells, boards
+    shm.close()
+
+####
+
+class TiledLife(object):
+    """Torus split into horizontal bands, one worker process per band.
+
+    Both boards live in shared memory.  While the render loop
+    draws the finished generation, the workers already compute
+    the next one into the other board; a barrier hands it over.
     """
-    old_cells = populate_cells(MAX_X, MAX_Y)
-    new_cells = {}
+    def __init__(self, max_x, max_y, ratio=8, cells=None, rule=None, seed=None, workers=None):
+
+        if np is None:
+            raise RuntimeError("TiledLife needs numpy")
+        self.max_x = max_x
+        self.max_y = max_y
+        self.workers = min(workers or multiprocessing.cpu_count(), max_y)
+        self.shm = shared_memory.SharedMemory(create=True, size=2 * max_x * max_y)
+        self.boards = np.ndarray((2, max_y, max_x), np.uint8, buffer=self.shm.buf)
+        self.boards[0] = populate_array(max_x, max_y, ratio, seed) if cells is None else cells
+        self.current = 0
+
+        self.start = multiprocessing.Barrier(self.workers + 1)
+        self.done = multiprocessing.Barrier(self.workers + 1)
+        self.stop = multiprocessing.Value('b', 0)
+        bounds = [max_y * i // self.workers for i in range(self.workers + 1)]
+        self.processes = [multiprocessing.Process(target=band_worker,
+                                                  args=(self.shm.name, max_x, max_y, y0, y1,
+                                                        self.start, self.done, self.stop, rule),
+                                                  daemon=True)
+                          for y0, y1 in zip(bounds, bounds[1:])]
+        for p in self.processes:
+            p.start()
+        self.start.wait()
+
+
+    @property
+    def cells(self):
+
+        return self.boards[self.current]
+
+
+    def step(self):
+
+        self.done.wait()
+        self.current = 1 - self.current
+        self.start.wait()
+
+
+    def living(self):
+
+        ys, xs = np.nonzero(self.cells)
+        return zip(xs.tolist(), ys.tolist())
+
+
+    def as_array(self):
+
+        return self.cells
+
+
+    def board_bytes(self):
+
+        return self.boards.nbytes
+
+
+    def close(self):
+
+        self.done.wait()
+        self.stop.value = 1
+        self.start.wait()
+        for p in self.processes:
+            p.join()
+        del self.boards
+        self.shm.close()
+        self.shm.unlink()
+
+####
+
+class Node(object):
+    """Quadtree node of level k, covering 2**k x 2**k cells.
+
+    Level 0 nodes are single cells.  Nodes are canonical:
+    HashLife.join() returns the same object for equal quadrants,
+    so they can be compared and hashed by identity.
+    """
+    __slots__ = ('nw', 'ne', 'sw', 'se', 'level', 'population')
+
+    def __init__(self, nw, ne, sw, se, level, population):
+
+        self.nw = nw
+        self.ne = ne
+        self.sw = sw
+        self.se = se
+        self.level = level
+        self.population = population
+
+####
+
+class HashLife(object):
+    """Memoized quadtree ('Hashlife') for jumping many generations at once.
+
+    The world is an unbounded plane, not the MAX_X x MAX_Y torus:
+    cells leaving the seeded area keep going, and living()
+    shows the window (0, 0, max_x, max_y).
+
+    Results are kept in a LRU cache of max_cache entries.  If there
+    are more than max_nodes canonical nodes after a jump, nodes not
+    reachable from the current world are dropped together with the cache.
+    """
+    UNBOUNDED = True
+
+    def __init__(self, max_x, max_y, ratio=8, cells=None, rule=None, seed=None,
+                 step_size=HASHLIFE_STEP, max_cache=1 << 20, max_nodes=1 << 21):
+
+        self.max_x = max_x
+        self.max_y = max_y
+        self.rule = parse_rule(rule or 'life')
+        if self.rule[0][0]:
+            raise ValueError("HashLife can't grow empty space (B0 rule)")
+        self.step_size = step_size
+        self.max_cache = max_cache
+        self.max_nodes = max_nodes
+        self.off = Node(None, None, None, None, 0, 0)
+        self.on = Node(None, None, None, None, 0, 1)
+        self.table = {}
+        self.empties = [self.off]
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        if cells is None:
+            cells = populate_cells(max_x, max_y, ratio, seed)
+            cells = [xy for xy, alive in cells.items() if alive]
+        elif hasattr(cells, 'nonzero'):
+            ys, xs = cells.nonzero()
+            cells = zip(xs.tolist(), ys.tolist())
+        self.root, self.x0, self.y0 = self.build(cells)
+
+
+    def join(self, nw, ne, sw, se):
+        """Canonical node for 4 quadrants."""
+        key = nw, ne, sw, se
+        node = self.table.get(key)
+        if node is None:
+            node = Node(nw, ne, sw, se, nw.level + 1,
+                        nw.population + ne.population + sw.population + se.population)
+            self.table[key] = node
+        return node
+
+
+    def empty(self, level):
+
+        while len(self.empties) <= level:
+            e = self.empties[-1]
+            self.empties.append(self.join(e, e, e, e))
+        return self.empties[level]
+
+
+    def build(self, cells):
+        """Quadtree of living cells, returns root and its upper left corner."""
+        cells = list(cells)
+        if not cells:
+            return self.empty(3), 0, 0
+        x0 = min(x for x, _ in cells)
+        y0 = min(y for _, y in cells)
+        nodes = dict(((x - x0, y - y0), self.on) for x, y in cells)
+        level = 0
+        while level < 3 or len(nodes) > 1 or (0, 0) not in nodes:
+            e = self.empty(level)
+            parents = {}
+            for x, y in nodes:
+                parents[x // 2, y // 2] = None
+            for px, py in parents:
+                x, y = 2 * px, 2 * py
+                parents[px, py] = self.join(nodes.get((x, y), e), nodes.get((x + 1, y), e),
+                                            nodes.get((x, y + 1), e), nodes.get((x + 1, y + 1), e))
+            nodes = parents
+            level += 1
+
+        return nodes[0, 0], x0, y0
+
+
+    def centre(self, node):
+        """Node of the next level with node in its middle."""
+        e = self.empty(node.level - 1)
+        return self.join(self.join(e, e, e, node.nw), self.join(e, e, node.ne, e),
+                         self.join(e, node.sw, e, e), self.join(node.se, e, e, e))
+
+
+    def inner(self, node):
+        """Middle quadrant of node."""
+        return self.join(node.nw.se, node.ne.sw, node.sw.ne, node.se.nw)
+
+
+    def life_4x4(self, node):
+        """Middle 2 x 2 cells of a level 2 node after 1 generation."""
+        quads = ((node.nw, node.ne), (node.sw, node.se))
+        grid = [[0] * 4 for _ in range(4)]
+        for y in range(4):
+            for x in range(4):
+                q = quads[y // 2][x // 2]
+                leaf = ((q.nw, q.ne), (q.sw, q.se))[y % 2][x % 2]
+                grid[y][x] = leaf.population
+        result = []
+        for x, y in ((1, 1), (2, 1), (1, 2), (2, 2)):
+            neighbors = sum(grid[y + j][x + i] for i, j in OFFSETS)
+            result.append((self.off, self.on)[self.rule[grid[y][x]][neighbors]])
+
+        return self.join(*result)
+
+
+    def successor(self, node, j):
+        """Middle quadrant of node (level k >= 2) after 2**j generations, j <= k - 2."""
+        if node.population == 0:
+            return node.nw
+        key = node, j
+        result = self.cache.get(key)
+        if result is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return result
+        self.misses += 1
+
+        if node.level == 2:
+            result = self.life_4x4(node)
+        else:
+            join, succ = self.join, self.successor
+            nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+            half = min(j, node.level - 3)
+            # 9 overlapping sub squares of level k - 1
+            c1 = succ(join(nw.nw, nw.ne, nw.sw, nw.se), half)
+            c2 = succ(join(nw.ne, ne.nw, nw.se, ne.sw), half)
+            c3 = succ(join(ne.nw, ne.ne, ne.sw, ne.se), half)
+            c4 = succ(join(nw.sw, nw.se, sw.nw, sw.ne), half)
+            c5 = succ(join(nw.se, ne.sw, sw.ne, se.nw), half)
+            c6 = succ(join(ne.sw, ne.se, se.nw, se.ne), half)
+            c7 = succ(join(sw.nw, sw.ne, sw.sw, sw.se), half)
+            c8 = succ(join(sw.ne, se.nw, sw.se, se.sw), half)
+            c9 = succ(join(se.nw, se.ne, se.sw, se.se), half)
+            if j < node.level - 2:
+                # 2**j generations are done, just cut out the middle
+                result = join(join(c1.se, c2.sw, c4.ne, c5.nw),
+                              join(c2.se, c3.sw, c5.ne, c6.nw),
+                              join(c4.se, c5.sw, c7.ne, c8.nw),
+                              join(c5.se, c6.sw, c8.ne, c9.nw))
+            else:
+                # 2 times 2**(k-3) generations
+                result = join(succ(join(c1, c2, c4, c5), half),
+                              succ(join(c2, c3, c5, c6), half),
+                              succ(join(c4, c5, c7, c8), half),
+                              succ(join(c5, c6, c8, c9), half))
+
+        self.cache[key] = result
+        if len(self.cache) > self.max_cache:
+            self.cache.popitem(last=False)
 
+        return result
+
+
+    def jump(self, generations):
+        """Advance the world by any number of generations."""
+        j = 0
+        while generations:
+            if generations & 1:
+                self.advance(j)
+            generations >>= 1
+            j += 1
+        if len(self.table) > self.max_nodes:
+            self.collect()
+
+
+    def advance(self, j):
+        """Advance the world by 2**j generations."""
+        root = self.root
+        while root.level < j + 2 or self.inner(self.inner(root)).population != root.population:
+            self.x0 -= 1 << (root.level - 1)
+            self.y0 -= 1 << (root.level - 1)
+            root = self.centre(root)
+        # successor() returns the middle, which is root's square again
+        self.root = self.successor(self.centre(root), j)
+        self.generation += 1 << j
+
+
+    def collect(self):
+        """Forget nodes which are not part of the world and all results."""
+        self.cache.clear()
+        table = {}
+        todo = [self.root] + self.empties[1:]
+        while todo:
+            node = todo.pop()
+            key = node.nw, node.ne, node.sw, node.se
+            if node.level and key not in table:
+                table[key] = node
+                todo.extend(key)
+        self.table = table
+
+
+    def stats(self):
+        """Numbers for sizing the cache."""
+        lookups = self.hits + self.misses
+        return {'nodes': len(self.table),
+                'cached': len(self.cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+    def step(self):
+
+        self.jump(self.step_size)
+
+
+    def living(self):
+        """Living cells inside the window."""
+        todo = [(self.root, self.x0, self.y0)]
+        while todo:
+            node, x, y = todo.pop()
+            size = 1 << node.level
+            if (node.population == 0 or x >= self.max_x or y >= self.max_y
+                    or x + size <= 0 or y + size <= 0):
+                continue
+            if node.level == 0:
+                yield x, y
+            else:
+                half = size // 2
+                todo.extend(((node.nw, x, y), (node.ne, x + half, y),
+                             (node.sw, x, y + half), (node.se, x + half, y + half)))
+
+
+    def board_bytes(self):
+        """Canonical nodes only, the result cache is not counted."""
+        return sys.getsizeof(self.table) + len(self.table) * (
+            sys.getsizeof(self.root) + sys.getsizeof((None,) * 4))
+
+####
+
+class ChunkStore(object):
+    """Square uint8 chunks keyed by chunk coordinates.
+
+    At most max_resident chunks are kept in memory, the least recently
+    used others are paged out to slots of a memory mapped temporary file.
+    """
+    def __init__(self, size, max_resident):
+
+        self.size = size
+        self.max_resident = max_resident
+        self.resident = collections.OrderedDict()
+        self.paged = {}
+        self.free = []
+        self.file = tempfile.TemporaryFile()
+        self.slots = None
+
+
+    def __contains__(self, key):
+
+        return key in self.resident or key in self.paged
+
+
+    def keys(self):
+
+        return list(self.resident) + list(self.paged)
+
+
+    def peek(self, key):
+        """Chunk for reading, without paging it in."""
+        if key in self.resident:
+            return self.resident[key]
+        if key in self.paged:
+            return self.slots[self.paged[key]]
+
+
+    def get(self, key):
+        """Chunk or None, paged in if needed."""
+        chunk = self.resident.get(key)
+        if chunk is not None:
+            self.resident.move_to_end(key)
+        elif key in self.paged:
+            slot = self.paged.pop(key)
+            chunk = np.array(self.slots[slot])
+            self.free.append(slot)
+            self.resident[key] = chunk
+            self.evict()
+        return chunk
+
+
+    def put(self, key, chunk):
+
+        self.delete(key)
+        self.resident[key] = chunk
+        self.evict()
+
+
+    def delete(self, key):
+
+        self.resident.pop(key, None)
+        if key in self.paged:
+            self.free.append(self.paged.pop(key))
+
+
+    def evict(self):
+
+        while len(self.resident) > self.max_resident:
+            key, chunk = self.resident.popitem(last=False)
+            if not self.free:
+                self.grow()
+            slot = self.free.pop()
+            self.slots[slot] = chunk
+            self.paged[key] = slot
+
+
+    def grow(self):
+        """Double the backing file."""
+        count = 0 if self.slots is None else len(self.slots)
+        new_count = max(64, 2 * count)
+        self.file.truncate(new_count * self.size * self.size)
+        self.slots = np.memmap(self.file, np.uint8, 'r+', shape=(new_count, self.size, self.size))
+        self.free.extend(range(new_count - 1, count - 1, -1))
+
+
+    def resident_bytes(self):
+
+        return len(self.resident) * self.size * self.size
+
+####
+
+class ChunkedLife(object):
+    """Unbounded world of CHUNK x CHUNK tiles, kept in a ChunkStore.
+
+    Only chunks that changed in the last generation and their neighbors
+    are stepped, the others can't change.  Still lifes and empty space
+    cost nothing, and their chunks go cold and are paged out, so memory
+    follows the active area and not the bounding box of the pattern.
+    living() shows the window (0, 0, max_x, max_y).
+    """
+    UNBOUNDED = True
+
+    def __init__(self, max_x, max_y, ratio=8, cells=None, rule=None, seed=None,
+                 chunk=CHUNK, max_resident=4096):
+
+        if np is None:
+            raise RuntimeError("ChunkedLife needs numpy")
+        if rule is not None and parse_rule(rule)[0][0]:
+            raise ValueError("ChunkedLife can't grow empty space (B0 rule)")
+        self.max_x = max_x
+        self.max_y = max_y
+        self.chunk = chunk
+        self.table = compile_table(rule)
+        self.store = ChunkStore(chunk, max_resident)
+        self.padded = np.zeros((chunk + 2, chunk + 2), np.uint8)
+        self.neighbors = np.zeros((chunk, chunk), np.uint8)
+        self.scratch = np.zeros_like(self.neighbors)
+        self.board = np.zeros((max_y, max_x), np.uint8)
+        self.generation = 0
+
+        if cells is None:
+            cells = populate_array(max_x, max_y, ratio, seed)
+        for cy in range(0, max_y, chunk):
+            for cx in range(0, max_x, chunk):
+                tile = cells[cy:cy + chunk, cx:cx + chunk]
+                if tile.any():
+                    new_tile = np.zeros((chunk, chunk), np.uint8)
+                    new_tile[:tile.shape[0], :tile.shape[1]] = tile
+                    self.store.put((cx // chunk, cy // chunk), new_tile)
+        self.active = set(self.store.keys())
+
+
+    def pad(self, cx, cy):
+        """Chunk cx, cy with the border cells of its 8 neighbors, False if all are empty."""
+        padded = self.padded
+        padded.fill(0)
+        found = False
+        for i, j, dest, src in ((0, 0, (slice(1, -1), slice(1, -1)), Ellipsis),
+                                (0, -1, (0, slice(1, -1)), -1),
+                                (0, 1, (-1, slice(1, -1)), 0),
+                                (-1, 0, (slice(1, -1), 0), (Ellipsis, -1)),
+                                (1, 0, (slice(1, -1), -1), (Ellipsis, 0)),
+                                (-1, -1, (0, 0), (-1, -1)),
+                                (1, -1, (0, -1), (-1, 0)),
+                                (-1, 1, (-1, 0), (0, -1)),
+                                (1, 1, (-1, -1), (0, 0))):
+            chunk = self.store.get((cx + i, cy + j))
+            if chunk is not None:
+                padded[dest] = chunk[src]
+                found = True
+
+        return found
+
+
+    def step(self):
+
+        candidates = set()
+        for cx, cy in self.active:
+            candidates.update((cx + i, cy + j) for i, j in OFFSETS)
+            candidates.add((cx, cy))
+
+        new_chunks = {}
+        for key in candidates:
+            if not self.pad(*key):
+                continue
+            new_chunk = np.zeros_like(self.neighbors)
+            if self.table is None:
+                count_neighbors(self.padded, self.neighbors)
+                apply_rule(self.padded[1:-1, 1:-1], self.neighbors, new_chunk, self.scratch)
+            else:
+                count_neighbors(self.padded, self.neighbors, 9)
+                apply_table(self.neighbors, new_chunk, self.scratch, self.table)
+            new_chunks[key] = new_chunk
+
+        self.active = set()
+        for key, new_chunk in new_chunks.items():
+            old_chunk = self.store.get(key)
+            alive = new_chunk.any()
+            if old_chunk is None:
+                if alive:
+                    self.store.put(key, new_chunk)
+                    self.active.add(key)
+            elif not np.array_equal(old_chunk, new_chunk):
+                if alive:
+                    self.store.put(key, new_chunk)
+                else:
+                    self.store.delete(key)
+                self.active.add(key)
+        self.generation += 1
+
+
+    def as_array(self):
+        """Window (0, 0, max_x, max_y), without paging chunks in."""
+        c = self.chunk
+        board = self.board
+        board.fill(0)
+        for cy in range(0, (self.max_y + c - 1) // c):
+            for cx in range(0, (self.max_x + c - 1) // c):
+                chunk = self.store.peek((cx, cy))
+                if chunk is not None:
+                    tile = board[cy * c:cy * c + c, cx * c:cx * c + c]
+                    tile[...] = chunk[:tile.shape[0], :tile.shape[1]]
+        return board
+
+
+    def living(self):
+
+        ys, xs = np.nonzero(self.as_array())
+        return zip(xs.tolist(), ys.tolist())
+
+
+    def bounding_box(self):
+        """Chunk aligned box around all chunks: x0, y0, x1, y1 in cells."""
+        keys = self.store.keys()
+        if not keys:
+            return 0, 0, 0, 0
+        c = self.chunk
+        return (min(x for x, _ in keys) * c, min(y for _, y in keys) * c,
+                (max(x for x, _ in keys) + 1) * c, (max(y for _, y in keys) + 1) * c)
+
+
+    def board_bytes(self):
+        """Resident chunks only, paged out ones are in the file."""
+        return self.store.resident_bytes()
+
+####
+
+ENGINES = {'dict': DictLife,
+           'active': ActiveLife,
+           'array': ArrayLife,
+           'bitboard': BitLife,
+           'hashlife': HashLife,
+           'tiled': TiledLife,
+           'chunked': ChunkedLife}
+
+####
+
+def generations_per_sec(engine, generations=100):
+    """Step engine without drawing and measure its speed."""
+    start = time.perf_counter()
+    for _ in range(generations):
+        engine.step()
+
+    return generations / (time.perf_counter() - start)
+
+####
+
+def bits_per_cell(engine):
+    """Memory of the board (without temporary buffers) per cell."""
+    return 8.0 * engine.board_bytes() / (engine.max_x * engine.max_y)
+
+####
+
+def benchmark_tiled(max_x=4000, max_y=4000, generations=50):
+    """Generations per second of TiledLife for 1 up to all cores."""
+    cells = populate_array(max_x, max_y)
+    workers = 1
+    while True:
+        engine = TiledLife(max_x, max_y, cells=cells, workers=workers)
+        print("{:3d} workers: {:8.2f} generations/sec".format(
+            workers, generations_per_sec(engine, generations)))
+        engine.close()
+        if workers >= multiprocessing.cpu_count():
+            break
+        workers = min(2 * workers, multiprocessing.cpu_count())
+
+####
+
+def benchmark_rules(generations=20):
+    """B3/S23 with branches against the same rule given as B/S string
+    and against HighLife, which is a lookup table for every engine."""
+    for engine_cls, max_x, max_y in (DictLife, MAX_X, MAX_Y), (ArrayLife, 2000, 2000):
+        times = []
+        for rule in None, 'B3/S23', 'B36/S23':
+            engine = engine_cls(max_x, max_y, rule=rule)
+            rate = generations_per_sec(engine, generations)
+            times.append(rate)
+            print("{:10s} {:8s}: {:10.2f} generations/sec".format(
+                engine_cls.__name__, rule or 'branches', rate))
+        print("{:10s} B3/S23 / branches: {:.2f}, B36/S23 / branches: {:.2f}".format(
+            engine_cls.__name__, times[1] / times[0], times[2] / times[0]))
+
+####
+
+def benchmark_seeding(max_x=4000, max_y=4000):
+    """Startup time of a random board and of a RLE pattern of the same board."""
+    start = time.perf_counter()
+    board = populate_array(max_x, max_y, seed=1)
+    print("random {}x{}: {:.3f} secs".format(max_x, max_y, time.perf_counter() - start))
+    for engine_cls in ArrayLife, BitLife:
+        start = time.perf_counter()
+        engine_cls(max_x, max_y, seed=1)
+        print("{:10s} startup: {:.3f} secs".format(engine_cls.__name__, time.perf_counter() - start))
+
+    path = os.path.join(tempfile.mkdtemp(), 'random.rle')
+    with open(path, 'w') as f:
+        f.write("x = {}, y = {}, rule = B3/S23\n".format(max_x, max_y))
+        for row in board:
+            changes = np.flatnonzero(np.diff(row, prepend=0, append=0))
+            runs = (changes[1:] - changes[:-1]).tolist()
+            f.write(''.join("{}{}".format(n, 'bo'[i % 2]) for i, n in enumerate([changes[0]] + runs)
+                            if n) + '$\n')
+        f.write('!\n')
+    start = time.perf_counter()
+    placed = place_pattern(np.zeros_like(board), path)
+    print("{:.1f} MB pattern: {:.3f} secs".format(os.path.getsize(path) / 1e6, time.perf_counter() - start))
+    assert np.array_equal(placed, board)
+    os.remove(path)
+
+####
+
+def benchmark_chunked(generations=4000, max_resident=8):
+    """Resident memory of ChunkedLife while a soup sends gliders away,
+    with fewer resident chunks than chunks, so the others are paged out."""
+    engine = ChunkedLife(256, 256, ratio=2, seed=1, max_resident=max_resident)
+    start = time.perf_counter()
+    for generation in range(1, generations + 1):
+        engine.step()
+        if generation % 500 == 0:
+            x0, y0, x1, y1 = engine.bounding_box()
+            print("{:6d}: box {:5d} x {:5d}, {:4d} chunks, {:3d} active, {:4d} paged out, "
+                  "{:7d} bytes resident, {:.2f} ms/gen".format(
+                      generation, x1 - x0, y1 - y0, len(engine.store.keys()), len(engine.active),
+                      len(engine.store.paged), engine.board_bytes(),
+                      1000 * (time.perf_counter() - start) / generation))
+
+####
+
+BENCHMARKS = {'tiled': benchmark_tiled,
+              'rules': benchmark_rules,
+              'seeding': benchmark_seeding,
+              'chunked': benchmark_chunked}
+
+####
+
+class FrameProducer(threading.Thread):
+    """Step an engine in its own thread, apart from the render loop.
+
+    Every generation is copied into one of 3 preallocated boards:
+    the newest finished one, the one the renderer is drawing, and one
+    to write.  The render loop uses it like an engine: step() takes the
+    newest board, so generations finished in between are dropped.
+    """
+    def __init__(self, engine):
+
+        super(FrameProducer, self).__init__()
+        self.daemon = True
+        self.engine = engine
+        self.max_x = engine.max_x
+        self.max_y = engine.max_y
+        self.boards = [np.zeros((self.max_y, self.max_x), np.uint8) for _ in range(3)]
+        self.lock = threading.Lock()
+        self.copy_board(self.boards[0])
+        self.newest = self.reading = 0
+        self.generations = self.shown = self.frames = self.dropped = 0
+        self.running = True
+        self.last = time.perf_counter(), 0, 0
+        self.start()
+
+
+    def copy_board(self, board):
+
+        if hasattr(self.engine, 'as_array'):
+            np.copyto(board, self.engine.as_array())
+        else:
+            board.fill(0)
+            for x, y in self.engine.living():
+                board[y, x] = 1
+
+
+    def run(self):
+
+        while self.running:
+            self.engine.step()
+            with self.lock:
+                slot = ({0, 1, 2} - {self.newest, self.reading}).pop()
+            self.copy_board(self.boards[slot])
+            with self.lock:
+                self.newest = slot
+                self.generations += 1
+
+
+    def step(self):
+        """Take the newest generation, if there is one."""
+        with self.lock:
+            self.frames += 1
+            if self.generations > self.shown:
+                self.dropped += self.generations - self.shown - 1
+                self.shown = self.generations
+                self.reading = self.newest
+
+
+    @property
+    def cells(self):
+
+        return self.boards[self.reading]
+
+
+    def as_array(self):
+
+        return self.cells
+
+
+    def living(self):
+
+        ys, xs = np.nonzero(self.cells)
+        return zip(xs.tolist(), ys.tolist())
+
+
+    def rates(self):
+        """Generations and frames per second since the last call."""
+        now, generations, frames = time.perf_counter(), self.generations, self.frames
+        then, old_generations, old_frames = self.last
+        self.last = now, generations, frames
+        return (generations - old_generations) / (now - then), (frames - old_frames) / (now - then)
+
+
+    def close(self):
+
+        self.running = False
+        self.join()
+        if hasattr(self.engine, 'close'):
+            self.engine.close()
+
+####
+
+def generation_hash(engine):
+    """Cheap 64 bit fingerprint of the board."""
+    cells = getattr(engine, 'cells', None)
+    if isinstance(cells, dict):
+        data = bytes(cells.values())
+    elif cells is not None:
+        data = cells.tobytes()
+    else:
+        data = repr(sorted(engine.living())).encode()
+
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+####
+
+class CycleDetector(object):
+    """Remember the hashes of the last `window` steps and report
+    when the board repeats one of them.
+
+    A step must be one generation of the whole world, so UNBOUNDED
+    engines are left out: they show only a window of the world,
+    and HashLife jumps step_size generations at once."""
+
+    def __init__(self, window=64):
+
+        self.window = window
+        self.recent = collections.deque()
+        self.seen = {}
+        self.steps = 0
+        self.period = None
+
+
+    def update(self, engine):
+        """Hash the board, returns the period (1 for a still life) or None."""
+        h = generation_hash(engine)
+        if h in self.seen:
+            self.period = self.steps - self.seen[h]
+        self.seen[h] = self.steps
+        self.recent.append(h)
+        if len(self.recent) > self.window:
+            old = self.recent.popleft()
+            if self.seen[old] <= self.steps - self.window:
+                del self.seen[old]
+        self.steps += 1
+
+        return self.period
+
+####
+
+class CycleReplay(object):
+    """Record one period of a cycling engine and play it again and again."""
+
+    def __init__(self, engine, period):
+
+        self.source = engine
+        self.max_x = engine.max_x
+        self.max_y = engine.max_y
+        self.frames = []
+        for _ in range(period):
+            self.frames.append((list(engine.living()),
+                                getattr(engine, 'births', []), getattr(engine, 'deaths', [])))
+            engine.step()
+        self.board = np.zeros((self.max_y, self.max_x), np.uint8)
+        self.index = 0
+
+
+    def step(self):
+
+        self.index = (self.index + 1) % len(self.frames)
+
+
+    def living(self):
+
+        return self.frames[self.index][0]
+
+
+    @property
+    def births(self):
+
+        return self.frames[self.index][1]
+
+
+    @property
+    def deaths(self):
+
+        return self.frames[self.index][2]
+
+
+    def as_array(self):
+
+        self.board.fill(0)
+        for x, y in self.living():
+            self.board[y, x] = 1
+        return self.board
+
+
+    def close(self):
+
+        if hasattr(self.source, 'close'):
+            self.source.close()
+
+####
+
+def run_until_cycle(engine, max_steps=100000, window=64):
+    """Step without drawing until the board repeats.
+
+    Returns the number of steps and the period (None if max_steps ran out)."""
+    if getattr(engine, 'UNBOUNDED', False):
+        raise ValueError("{} has no bounded board to repeat".format(type(engine).__name__))
+    detector = CycleDetector(window)
+    for steps in range(max_steps):
+        if detector.update(engine):
+            return steps, detector.period
+        engine.step()
+
+    return max_steps, None
+
+####
+
+def cell_rect(x, y):
+
+    return x * CELL_WIDTH, y * CELL_HEIGHT, CELL_WIDTH, CELL_HEIGHT
+
+####
+
+class RectRenderer(object):
+    """Clear the screen and draw every living cell."""
+
+    def draw(self, screen, engine):
+        """Returns the rectangles to update, None for the whole screen."""
+        screen.fill(BACK_COLOR)
+        for x, y in engine.living():
+            pygame.draw.rect(screen, CELL_COLOR, cell_rect(x, y))
+
+
+class PatchRenderer(object):
+    """Draw the board once, then only births and deaths of an ActiveLife."""
+
+    def __init__(self):
+
+        self.drawn = False
+
+
+    def draw(self, screen, engine):
+
+        if not self.drawn:
+            self.drawn = True
+            return RectRenderer().draw(screen, engine)
+
+        rects = []
+        for color, cells in ((CELL_COLOR, engine.births), (BACK_COLOR, engine.deaths)):
+            for x, y in cells:
+                rects.append(screen.fill(color, cell_rect(x, y)))
+
+        return rects
+
+
+class PixelRenderer(object):
+    """One pixel per cell on a small 8 bit surface (palette: BACK_COLOR,
+    CELL_COLOR), scaled up to cell size and blitted at once.
+
+    Engines with as_array() are copied straight into the surface,
+    for others the living cells are set in a reused array.
+    """
+    def __init__(self, max_x, max_y):
+
+        self.small = pygame.Surface((max_x, max_y), depth=8)
+        self.big = pygame.Surface((max_x * CELL_WIDTH, max_y * CELL_HEIGHT), depth=8)
+        for surface in self.small, self.big:
+            surface.set_palette([BACK_COLOR, CELL_COLOR] * 128)
+        self.board = np.zeros((max_y, max_x), np.uint8)
+        self.drawn = False
+
+
+    def draw(self, screen, engine):
+
+        if not self.drawn:
+            # border right and below the cells
+            self.drawn = True
+            screen.fill(BACK_COLOR)
+        if hasattr(engine, 'as_array'):
+            board = engine.as_array()
+        else:
+            board = self.board
+            board.fill(0)
+            for x, y in engine.living():
+                board[y, x] = 1
+        pygame.surfarray.blit_array(self.small, board.T)
+        pygame.transform.scale(self.small, self.big.get_size(), self.big)
+        screen.blit(self.big, (0, 0))
+
+####
+
+def simulate(screen, clock, engine=None, renderer=None, freeze=False):
+    """
+    Step the engine and draw its living cells.
+    If the board runs into a still life or a cycle, show it
+    in the caption, with freeze replay the cycle without simulating.
+    A FrameProducer engine reports simulation and render rates there.
+    """
+    if engine is None:
+        engine = DictLife(MAX_X, MAX_Y)
+    if renderer is None:
+        if isinstance(engine, ActiveLife):
+            renderer = PatchRenderer()
+        elif hasattr(engine, 'as_array'):
+            renderer = PixelRenderer(engine.max_x, engine.max_y)
+        else:
+            renderer = RectRenderer()
+
+    # a FrameProducer shows the same generation more than once or skips some,
+    # an unbounded engine shows only a window
+    detector = (None if isinstance(engine, FrameProducer) or getattr(engine, 'UNBOUNDED', False)
+                else CycleDetector())
+    caption = "Conway's Game of Life (ESC to quit)"
+    next_report = time.perf_counter() + 1
     running = True
     while running:
 
-        screen.fill((20, 20, 20))
-
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
@@ -85,23 +1609,70 @@ def simulate(screen, clock):
                     running = False
                     break
 
-        for y in range(MAX_Y):
-            for x in range(MAX_X):
-                if old_cells[x, y]:
-                    pygame.draw.rect(screen, CELL_COLOR,
-                                     (x * CELL_WIDTH, y * CELL_HEIGHT,
-                                      CELL_WIDTH, CELL_HEIGHT))
-                dead_or_alive(old_cells, x, y, new_cells)
+        rects = renderer.draw(screen, engine)
+        if detector and detector.update(engine):
+            period = detector.period
+            print("Cycle of period {} after {} steps".format(period, detector.steps - 1))
+            caption += "   " + ("still life" if period == 1 else "period {}".format(period))
+            pygame.display.set_caption(caption)
+            detector = None
+            if freeze:
+                engine = CycleReplay(engine, period)
+        engine.step()
+
+        if hasattr(engine, 'rates') and time.perf_counter() > next_report:
+            next_report += 1
+            pygame.display.set_caption("{}   sim {:.1f} gen/s, render {:.1f} fps, {} dropped".format(
+                caption, *(engine.rates() + (engine.dropped,))))
 
-        old_cells = new_cells
-        new_cells = {}
         clock.tick(200)
-        pygame.display.update()
+        if rects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(rects)
 
+    if hasattr(engine, 'close'):
+        engine.close()
     pygame.quit()
 
 ####
 
 if __name__ == '__main__':
 
-    simulate(*init_pygame(WIDTH, HEIGHT))
+    # python life.py [dict|active|array|bitboard|hashlife|tiled|chunked] [rect|pixel] [freeze] [thread]
+    #                 [life|highlife|seeds|daynight|B../S..] [seed=<n>] [<pattern file>[@x,y]]
+    # python life.py bench [tiled|rules|seeding|chunked]
+    options = set(('freeze', 'thread')) & set(sys.argv)
+    for option in options:
+        sys.argv.remove(option)
+    freeze = 'freeze' in options
+    rule = pattern = seed = None
+    for arg in sys.argv[2:]:
+        path = arg.split('@')[0]
+        if os.path.splitext(path)[1] or os.path.isfile(path):
+            pattern = arg
+        elif arg.lower() in RULES or (arg.upper().startswith('B') and '/' in arg):
+            rule = arg
+        elif arg.startswith('seed='):
+            seed = int(arg[5:])
+        else:
+            continue
+        sys.argv.remove(arg)
+    name = sys.argv[1] if len(sys.argv) > 1 else 'dict'
+    if name == 'bench':
+        BENCHMARKS[sys.argv[2]]()
+        sys.exit()
+    cells = None
+    if pattern:
+        path, _, offset = pattern.partition('@')
+        x0, y0 = [int(v) for v in offset.split(',')] if offset else (0, 0)
+        cells = place_pattern(np.zeros((MAX_Y, MAX_X), np.uint8), path, x0, y0)
+    engine = ENGINES[name](MAX_X, MAX_Y, cells=cells, rule=rule, seed=seed)
+    print("{}: {:.2f} bits per cell".format(name, bits_per_cell(engine)))
+    if 'thread' in options:
+        engine = FrameProducer(engine)
+    renderer = None
+    if len(sys.argv) > 2:
+        renderer = (RectRenderer() if sys.argv[2] == 'rect'
+                    else PixelRenderer(MAX_X, MAX_Y))
+    simulate(*init_pygame(WIDTH, HEIGHT), engine=engine, renderer=renderer, freeze=freeze)
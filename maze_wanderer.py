@@ -4,13 +4,30 @@
 ####
 
 from __future__ import print_function
+import os
 import sys
+import struct
+import pickle
 import pygame as pyg
 import random as rand
 import math
+import time
+import collections
+import threading
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 if sys.version_info[0] >= 3:
+    import queue
     xrange = range
+    cpu_time = time.process_time
+else:
+    import Queue as queue
+    cpu_time = time.clock
 
 #### configuration
 
@@ -31,13 +48,23 @@ config =\
   'font_color': (255, 255, 255),
   'fps': 100,
   'dt': 0.01,
+  'swept': True,
+  'batch': False,
+  'max_dt': 0.05,
+  'max_substeps': 10,
+  'leftover': 'drop',
   'friction': 0.97,
+  'tile_size': 16,
+  'prefetch_levels': 3,
+  'maze_cells': (5000, 5000),
+  'maze_chunk': 32,
   'player_sizefac': 1.2,
   'player_color': (0, 0, 255),
   'player_accel': 400,
   'width_sensors': 8,
   'height_sensors': 8,
-  'title': "Maze Wanderer   (Move with Cursor Keys, press Esc to exit)",
+  'rewind_frames': 1000,
+  'title': "Maze Wanderer   (Cursor Keys move, Backspace rewinds, F5 saves, F9 loads, Esc exits)",
   'waiting_text': "quit=Esc, again=Other Key"}
 
 #### maps
@@ -132,7 +159,48 @@ DOWN = -1
 RANDOM = -2
 START = -3
 PLACES = set(('u', 'd', 'r', 'e'))
+# gap between player and wall after an impact
+SKIN = 0.01
+MAX_BOUNCES = 4
 NOT_DRAWABLES = set(('.', 's'))
+# map characters by number, start counts as floor
+KINDS = '.xudre'
+KIND_TABLE = bytes(bytearray(max(KINDS.find(chr(i)), 0) for i in xrange(256)))
+WALL = ord('x')
+FLOOR = ord('.')
+STEPS = (0, -1), (1, 0), (0, 1), (-1, 0)
+NO_STEP = 255
+# level, next random level, player x, y, dx, dy, xold, yold, timer accumulator
+SNAPSHOT = struct.Struct('<Hh7d')
+
+####
+
+class TextCache(object):
+    """Rendered text surfaces, kept in a LRU cache per font, text, color and antialiasing."""
+
+    def __init__(self, max_surfaces=64):
+
+        self.surfaces = collections.OrderedDict()
+        self.max_surfaces = max_surfaces
+
+
+    def render(self, font, text, color, antialias=True):
+
+        key = font, text, tuple(color), antialias
+        surface = self.surfaces.pop(key, None)
+        if surface is None:
+            surface = font.render(text, antialias, color)
+            if len(self.surfaces) >= self.max_surfaces:
+                self.surfaces.popitem(last=False)
+        self.surfaces[key] = surface
+        return surface
+
+####
+
+def move_lists(events, key_bits):
+    """For every bitmask of keys the list of their events."""
+
+    return [[events[k] for k in events if mask & key_bits[k]] for mask in xrange(1 << len(events))]
 
 ####
 
@@ -141,10 +209,18 @@ class PygView(object):
 
     CURSORKEYS = range(273, 277)
     QUIT_KEYS = pyg.K_ESCAPE, pyg.K_q
+    CONTROL_KEYS = {pyg.K_F5: 'save',
+                    pyg.K_F9: 'load'}
     EVENTS = {pyg.K_UP: 'up',
               pyg.K_DOWN: 'down',
               pyg.K_LEFT: 'left',
-              pyg.K_RIGHT: 'right'}
+              pyg.K_RIGHT: 'right',
+              pyg.K_BACKSPACE: 'rewind'}
+    # a bit per steering key, the moves of every combination in the order of EVENTS
+    KEY_BITS = dict((k, 1 << i) for i, k in enumerate(EVENTS))
+    MOVE_LISTS = move_lists(EVENTS, KEY_BITS)
+    # only these are queued, pygame drops all others
+    EVENT_TYPES = pyg.QUIT, pyg.KEYDOWN, pyg.KEYUP, pyg.ACTIVEEVENT
 
 
 
@@ -165,6 +241,11 @@ class PygView(object):
         self.clock = pyg.time.Clock()
         pyg.mouse.set_visible(config.visibmouse)
         self.font = pyg.font.Font(None, self.height // config.font_ratio)
+        self.texts = TextCache()
+        self.background = None
+        pyg.event.set_blocked(None)
+        pyg.event.set_allowed(PygView.EVENT_TYPES)
+        self.keys = self.pressed_keys()
 
 
     @property
@@ -185,42 +266,88 @@ class PygView(object):
             self.quit()
 
 
-    def get_events(self):
-        """There are 2 types of events:
-        unqueued key events for steering,
-        queued key events for common game control."""
+    def pressed_keys(self):
+        """Bitmask of the steering keys held down."""
 
         keys = pyg.key.get_pressed()
-        move_events = [PygView.EVENTS[k] for k in PygView.EVENTS if keys[k]]
+        mask = 0
+        for k, bit in PygView.KEY_BITS.items():
+            if keys[k]:
+                mask |= bit
+        return mask
 
+
+    def get_events(self):
+        """There are 2 types of events:
+        steering keys held down, as a bitmask updated by KEYDOWN and KEYUP,
+        key presses for common game control.
+        The queue is emptied every frame. Of its control events only one is returned:
+        quit before save or load before other keys."""
+
+        control = None
+        key_bits = PygView.KEY_BITS
         for event in pyg.event.get():
-            if event.type == pyg.QUIT:
-                return 'quit', move_events
             if event.type == pyg.KEYDOWN:
-                if event.key in PygView.QUIT_KEYS:
-                    return 'quit', move_events
-                else:
-                    return 'other_key', move_events
-        else:
-            return None, move_events
+                key = event.key
+                if key in key_bits:
+                    self.keys |= key_bits[key]
+                if key in PygView.QUIT_KEYS:
+                    control = 'quit'
+                elif key in PygView.CONTROL_KEYS:
+                    if control in (None, 'other_key'):
+                        control = PygView.CONTROL_KEYS[key]
+                elif control is None:
+                    control = 'other_key'
+            elif event.type == pyg.KEYUP:
+                if event.key in key_bits:
+                    self.keys &= ~key_bits[event.key]
+            elif event.type == pyg.QUIT:
+                control = 'quit'
+            else:
+                # focus changed, key ups may have gone elsewhere
+                self.keys = self.pressed_keys()
+
+        return control, PygView.MOVE_LISTS[self.keys]
+
+
+    def rectangle(self, xywh, color, border=0, surface=None):
+
+        pyg.draw.rect(self.canvas if surface is None else surface, color, xywh, border)
 
 
-    def rectangle(self, xywh, color, border=0):
+    def new_background(self):
+        """Surface of canvas size for static drawing."""
+        surface = pyg.Surface((self.width, self.height)).convert()
+        surface.fill(self.back_color)
+        return surface
 
-        pyg.draw.rect(self.canvas, color, xywh, border)
+
+    def set_background(self, surface):
+        """Use surface instead of back_color for clearing the canvas,
+        back to back_color with None."""
+        self.background = surface
+        if surface is None:
+            self.canvas.fill(self.back_color)
+        else:
+            self.canvas.blit(surface, (0, 0))
 
 
     def draw_text(self, text):
 
-        fw, fh = self.font.size(text)
-        surface = self.font.render(text, True, self.font_color)
+        if not text:
+            return
+        surface = self.texts.render(self.font, text, self.font_color)
+        fw, fh = surface.get_size()
         self.canvas.blit(surface, ((self.width - fw) // 2, (self.height - fh) // 2))
 
 
     def flip(self):
 
         pyg.display.flip()
-        self.canvas.fill(self.back_color)
+        if self.background is not None:
+            self.canvas.blit(self.background, (0, 0))
+        else:
+            self.canvas.fill(self.back_color)
 
 
     def quit(self):
@@ -229,6 +356,123 @@ class PygView(object):
 
 ####
 
+class Recording(object):
+    """Binary game log: a header with the seeds, then per frame
+    its duration in ms and its events, at the end the state of the game."""
+
+    header = struct.Struct('<4sIq')
+    frame = struct.Struct('<HB')
+    state = struct.Struct('<4dHB')
+    MAGIC = b'MAZ2'
+    # order of PygView.EVENTS, the moves are replayed in this order
+    MOVES = 'up', 'down', 'left', 'right', 'rewind'
+    EVENTS = None, 'quit', 'other_key', 'save', 'load'
+    STATES = 'playing', 'ending'
+
+    @staticmethod
+    def pack_frame(ms, event, move_events):
+        """Duration (at most 65535 ms) and events in 3 bytes:
+        the event in the upper 3 bits, a bit for each move in the lower 5."""
+
+        code = Recording.EVENTS.index(event) << 5
+        for move in move_events:
+            code |= 1 << Recording.MOVES.index(move)
+        return Recording.frame.pack(min(ms, 0xffff), code)
+
+
+    @staticmethod
+    def unpack_frames(data):
+
+        for i in xrange(0, len(data), Recording.frame.size):
+            ms, code = Recording.frame.unpack_from(data, i)
+            yield (ms, Recording.EVENTS[code >> 5],
+                   [move for i, move in enumerate(Recording.MOVES) if code & 1 << i])
+
+
+    @staticmethod
+    def game_state(controller):
+
+        player = controller.game.player
+        return (player.x, player.y, player.dx, player.dy,
+                controller.game.mapper.act_index, Recording.STATES.index(controller.state))
+
+
+    @staticmethod
+    def load(path):
+        """Return random seed, maze seed (-1 without maze), frames and final state."""
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, seed, maze_seed = Recording.header.unpack_from(data)
+        assert magic == Recording.MAGIC, "no maze recording"
+        frames = data[Recording.header.size:len(data) - Recording.state.size]
+        return seed, maze_seed, frames, Recording.state.unpack_from(data, len(data) - Recording.state.size)
+
+####
+
+class RecordingView(PygView):
+    """Pygame interface writing every frame into the file config.record."""
+
+    def __init__(self, controller, config):
+
+        PygView.__init__(self, controller, config)
+        seed = rand.randrange(1 << 32)
+        rand.seed(seed)
+        self.log = open(config.record, 'wb')
+        self.log.write(Recording.header.pack(Recording.MAGIC, seed, config.maze_seed))
+
+
+    def get_events(self):
+
+        event, move_events = PygView.get_events(self)
+        self.log.write(Recording.pack_frame(self.clock.get_time(), event, move_events))
+        if event == 'quit':
+            self.log.write(Recording.state.pack(*Recording.game_state(self.controller)))
+            self.log.close()
+        return event, move_events
+
+####
+
+class ReplayView(PygView):
+    """Feed the recording config.replay to the controller as fast as possible,
+    without a display. At the end compare the game with the recorded one."""
+
+    def __init__(self, controller, config):
+
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        PygView.__init__(self, controller, config)
+        self.fps = 0
+        seed, maze_seed, frames, self.final_state = Recording.load(config.replay)
+        rand.seed(seed)
+        self.frames = Recording.unpack_frames(frames)
+        self.frame_ms = 0
+        self.count = 0
+        self.recorded_ms = 0
+        self.start = time.time()
+
+
+    @property
+    def frame_duration_secs(self):
+
+        return 0.001 * self.frame_ms
+
+
+    def get_events(self):
+
+        self.frame_ms, event, move_events = next(self.frames)
+        self.count += 1
+        self.recorded_ms += self.frame_ms
+        if event == 'quit':
+            secs = time.time() - self.start
+            state = Recording.game_state(self.controller)
+            print("{} frames replayed, {:.0f} frames/sec, {:.1f} times real time".format(
+                self.count, self.count / secs, 0.001 * self.recorded_ms / secs))
+            print("final state", "matches" if state == self.final_state else "differs",
+                  state, self.final_state)
+        return event, move_events
+
+####
+
 class Grid(object):
     """Calculate points on a rectangular grid."""
 
@@ -257,6 +501,26 @@ class Grid(object):
         y = int(y+0.5)
         return (x-self.xoff+self.dx//2)//self.dx, (y-self.yoff+self.dy//2)//self.dy
 
+
+    def get_cell_box(self, x, y):
+        """Return left, top, width, height of the area snapping to cell x, y."""
+
+        return (self.xoff - self.dx//2 - 0.5 + x * self.dx,
+                self.yoff - self.dy//2 - 0.5 + y * self.dy, self.dx, self.dy)
+
+
+    def get_cell_range(self, x0, y0, x1, y1):
+        """Return first and behind last cell of the rectangles meeting the area x0, y0 .. x1, y1."""
+
+        return ((x0 - self.xoff) // self.dx, (y0 - self.yoff) // self.dy,
+                (x1 - self.xoff - 1) // self.dx + 1, (y1 - self.yoff - 1) // self.dy + 1)
+
+
+    def moved(self, x, y):
+        """Same grid, shifted by x, y."""
+
+        return Grid(self.dx, self.dy, self.xoff + x, self.yoff + y)
+
 ####
 
 class Map(object):
@@ -267,6 +531,10 @@ class Map(object):
         self.width = len(map_data[0])
         self.height = len(map_data)
         self.data = map_data
+        # one byte per cell, row by row, its index in KINDS
+        self.kinds = bytearray(''.join(map_data).encode('ascii')).translate(KIND_TABLE)
+        self.start = self.find_start()
+        self.places = dict((place, self.locate(place)) for place in PLACES)
 
 
     def __getitem__(self, x_y):
@@ -275,54 +543,535 @@ class Map(object):
         return self.data[y][x]
 
 
-    @property
-    def start(self):
+    def is_wall(self, x, y):
+
+        return self.kinds[y * self.width + x] == 1
+
+
+    def kind(self, x, y):
+        """Map character of x, y, start is floor."""
+
+        return KINDS[self.kinds[y * self.width + x]]
+
+
+    def walls_at(self, xs, ys):
+        """Wall flags of the cells xs, ys (numpy arrays)."""
+
+        return np.frombuffer(self.kinds, np.uint8)[ys * self.width + xs] == 1
+
+
+    def row(self, y, x0, x1):
+
+        return self.data[y][x0:x1]
+
+
+    def any_wall(self, x0, y0, x1, y1):
+        """Is there a wall in the cell block from x0, y0 to x1, y1 (inclusive)?"""
+
+        kinds = self.kinds
+        for y in xrange(y0 * self.width, (y1 + 1) * self.width, self.width):
+            if 1 in kinds[y + x0:y + x1 + 1]:
+                return True
+        return False
+
+
+    def find_start(self):
         """Search the starting point, there should be only one."""
 
         for i, y in enumerate(self.data):
-            for j, x in enumerate(y):
-                if x == 's':
-                    return j, i
+            j = y.find('s')
+            if j >= 0:
+                return j, i
+
+
+    def locate(self, place):
+        """Return all cells of a place."""
+
+        code = bytearray((KINDS.index(place),))
+        cells = []
+        i = self.kinds.find(code)
+        while i >= 0:
+            cells.append((i % self.width, i // self.width))
+            i = self.kinds.find(code, i + 1)
+        return cells
+
+####
+
+class MazeMap(object):
+    """Random maze of cells_x * cells_y cells, same interface as Map.
+    It is generated in chunks of chunk * chunk cells when they are looked at first,
+    every chunk is a perfect maze from a recursive backtracker seeded with seed
+    and the chunk position, neighbouring chunks are joined by a door."""
+
+    def __init__(self, cells_x, cells_y, seed=0, chunk=32, place_ratio=0.5):
+
+        self.cells_x = cells_x
+        self.cells_y = cells_y
+        self.width = 2 * cells_x + 1
+        self.height = 2 * cells_y + 1
+        self.seed = seed
+        self.chunk = chunk
+        self.span = 2 * chunk
+        self.place_ratio = place_ratio
+        self.chunks = {}
+        # y of the west and x of the north door of each chunk
+        self.doors = {}
+        # places of the chunks generated so far
+        self.places = dict((place, []) for place in PLACES)
+
+
+    def __getitem__(self, x_y):
+
+        return chr(self.tile(*x_y))
+
+
+    def is_wall(self, x, y):
+
+        return self.tile(x, y) == WALL
+
+
+    def kind(self, x, y):
+        """Map character of x, y, start is floor."""
+
+        return KINDS[max(KINDS.find(chr(self.tile(x, y))), 0)]
+
+
+    def walls_at(self, xs, ys):
+        """Wall flags of the cells xs, ys (numpy arrays)."""
+
+        return np.array([self.tile(x, y) == WALL for x, y in zip(xs.tolist(), ys.tolist())], bool)
+
+
+    def any_wall(self, x0, y0, x1, y1):
+        """Is there a wall in the cell block from x0, y0 to x1, y1 (inclusive)?"""
+
+        return any(self.tile(x, y) == WALL for y in xrange(y0, y1 + 1) for x in xrange(x0, x1 + 1))
+
+
+    def row(self, y, x0, x1):
+
+        if y >= self.height - 1:
+            return 'x' * (x1 - x0)
+
+        span = self.span
+        parts = []
+        x = x0
+        while x < min(x1, self.width - 1):
+            tiles, stride = self.get_chunk(x // span, y // span)
+            start = (y % span) * stride
+            end = min(x1 - x // span * span, stride)
+            parts.append(tiles[start + x % span:start + end].decode('ascii'))
+            x += end - x % span
+        return ''.join(parts) + 'x' * (x1 - x)
+
+
+    @property
+    def start(self):
+
+        return 1, 1
+
+
+    def tile(self, x, y):
+        """Map character of x, y as a number."""
+
+        # east and south border
+        if x >= self.width - 1 or y >= self.height - 1:
+            return WALL
+        span = self.span
+        tiles, stride = self.get_chunk(x // span, y // span)
+        return tiles[(y % span) * stride + x % span]
+
+
+    def get_chunk(self, cx, cy):
+        """Tiles of chunk cx, cy and their row length."""
+
+        chunk = self.chunks.get((cx, cy))
+        if chunk is None:
+            chunk = self.chunks[cx, cy] = self.generate(cx, cy)
+        return chunk
+
+
+    def passage(self, cx, cy, dx, dy):
+        """First tile of the neighbour chunk cx+dx, cy+dy
+        on the way through the door from chunk cx, cy."""
+
+        owner = cx + max(dx, 0), cy + max(dy, 0)
+        self.get_chunk(*owner)
+        west, north = self.doors[owner]
+        if dx:
+            return owner[0] * self.span - (dx < 0), west
+        return north, owner[1] * self.span - (dy < 0)
+
+
+    def generate(self, cx, cy):
+        """Carve chunk cx, cy out of solid wall.
+        Return its tiles as one byte per map character, row by row, and the row length.
+        Cell i, j of the chunk is tile 2i+1, 2j+1, the west and north border
+        of the chunk belong to it, so a chunk gets only a west and a north door."""
+
+        w = min(self.chunk, self.cells_x - cx * self.chunk)
+        h = min(self.chunk, self.cells_y - cy * self.chunk)
+        stride = 2 * w
+        tiles = bytearray(b'x') * (stride * 2 * h)
+        rnd = rand.Random('{}:{}:{}'.format(self.seed, cx, cy))
+
+        visited = bytearray(w * h)
+        i, j = rnd.randrange(w), rnd.randrange(h)
+        visited[j * w + i] = 1
+        tiles[(2 * j + 1) * stride + 2 * i + 1] = FLOOR
+        stack = [(i, j)]
+        while stack:
+            i, j = stack[-1]
+            free = [(i + di, j + dj) for di, dj in STEPS
+                    if 0 <= i + di < w and 0 <= j + dj < h and not visited[(j + dj) * w + i + di]]
+            if not free:
+                stack.pop()
+                continue
+            ni, nj = rnd.choice(free)
+            visited[nj * w + ni] = 1
+            tiles[(2 * nj + 1) * stride + 2 * ni + 1] = FLOOR
+            tiles[(j + nj + 1) * stride + i + ni + 1] = FLOOR
+            stack.append((ni, nj))
+
+        west = north = None
+        if cx > 0:
+            west = 2 * rnd.randrange(h) + 1
+            tiles[west * stride] = FLOOR
+            west += cy * self.span
+        if cy > 0:
+            north = 2 * rnd.randrange(w) + 1
+            tiles[north] = FLOOR
+            north += cx * self.span
+        self.doors[cx, cy] = west, north
+
+        place = None
+        if (cx + 1) * self.chunk >= self.cells_x and (cy + 1) * self.chunk >= self.cells_y:
+            place, x, y = 'e', 2 * w - 1, 2 * h - 1
+        elif (cx, cy) != (0, 0) and rnd.random() < self.place_ratio:
+            place, x, y = rnd.choice('udr'), 2 * rnd.randrange(w) + 1, 2 * rnd.randrange(h) + 1
+        if place and (x, y, cx, cy) != (1, 1, 0, 0):
+            tiles[y * stride + x] = ord(place)
+            self.places[place].append((cx * self.span + x, cy * self.span + y))
+        if (cx, cy) == (0, 0):
+            tiles[stride + 1] = ord('s')
+
+        return tiles, stride
+
+####
+
+class DistanceField(object):
+    """Steps from every floor cell of the rectangle x0, y0, width, height
+    to the nearest of the target cells, by a breadth first search.
+    For every cell the direction of the next step is kept too."""
+
+    def __init__(self, smap, targets, x0, y0, width, height):
+
+        self.x0 = x0
+        self.y0 = y0
+        self.width = width
+        self.height = height
+        self.dist = array('l', [-1]) * (width * height)
+        # index into STEPS, NO_STEP at the targets and for unreachable cells
+        self.flow = bytearray((NO_STEP,)) * (width * height)
+
+        queue = collections.deque()
+        for x, y in targets:
+            if 0 <= x - x0 < width and 0 <= y - y0 < height:
+                self.dist[(y - y0) * width + x - x0] = 0
+                queue.append((x, y))
+        while queue:
+            x, y = queue.popleft()
+            d = self.dist[(y - y0) * width + x - x0] + 1
+            for direction, (dx, dy) in enumerate(STEPS):
+                nx, ny = x + dx, y + dy
+                i = (ny - y0) * width + nx - x0
+                if (0 <= nx - x0 < width and 0 <= ny - y0 < height and self.dist[i] < 0
+                    and not smap.is_wall(nx, ny)):
+                    self.dist[i] = d
+                    # back the way we came
+                    self.flow[i] = (direction + 2) % 4
+                    queue.append((nx, ny))
+
+
+    def distance(self, x, y):
+        """Steps to the target, -1 if there is no way."""
+
+        return self.dist[(y - self.y0) * self.width + x - self.x0]
+
+
+    def next_step(self, x, y):
+        """Neighbour of x, y one step nearer to the target, None at the target or without way."""
+
+        direction = self.flow[(y - self.y0) * self.width + x - self.x0]
+        if direction == NO_STEP:
+            return None
+        dx, dy = STEPS[direction]
+        return x + dx, y + dy
+
+####
+
+class PathFinder(object):
+    """Answer where to go next to reach a target, which is a cell
+    or a place character (the nearest place of this sort,
+    on a MazeMap the nearest by chunks of those generated so far).
+    Distance fields are kept in a LRU cache per map and target.
+    A MazeMap gets a field per chunk only: towards the door of the next chunk
+    on the way to the target, or towards the target in its own chunk."""
+
+    def __init__(self, max_fields=64):
+
+        self.fields = collections.OrderedDict()
+        self.max_fields = max_fields
+        self.hits = 0
+        self.misses = 0
+
+
+    def field(self, smap, target, rect=None):
+        """Distance field of the cell or place target over rect (default whole map)."""
+
+        key = smap, target, rect
+        field = self.fields.pop(key, None)
+        if field is None:
+            self.misses += 1
+            targets = smap.places[target] if target in PLACES else [target]
+            x0, y0, width, height = rect or (0, 0, smap.width, smap.height)
+            field = DistanceField(smap, targets, x0, y0, width, height)
+            if len(self.fields) >= self.max_fields:
+                self.fields.popitem(last=False)
+        else:
+            self.hits += 1
+        self.fields[key] = field
+        return field
+
+
+    def next_step(self, smap, x, y, target):
+        """Neighbour cell of x, y on the way to target, None at the target or without way."""
+
+        if not isinstance(smap, MazeMap):
+            return self.field(smap, target).next_step(x, y)
+
+        if target == 'e':
+            target = smap.width - 2, smap.height - 2
+        elif target in PLACES:
+            if not smap.places[target]:
+                return None
+            target = self.nearest(smap, x, y, smap.places[target])
+
+        span = smap.span
+        cx, cy = x // span, y // span
+        dx, dy = target[0] // span - cx, target[1] // span - cy
+        if dx or dy:
+            # chunks next to each other are always joined, go along the longer way first
+            if abs(dx) >= abs(dy):
+                target = smap.passage(cx, cy, (dx > 0) - (dx < 0), 0)
+            else:
+                target = smap.passage(cx, cy, 0, (dy > 0) - (dy < 0))
+        # the chunk and the first tiles of its neighbours
+        x0, y0 = max(cx * span - 1, 0), max(cy * span - 1, 0)
+        x1, y1 = min((cx + 1) * span + 1, smap.width), min((cy + 1) * span + 1, smap.height)
+        return self.field(smap, target, (x0, y0, x1 - x0, y1 - y0)).next_step(x, y)
+
+
+    def nearest(self, smap, x, y, places):
+        """Place of the known ones with the fewest chunks to x, y, the first one
+        generated of equally near ones, so the choice doesn't flip on the way."""
+
+        span = smap.span
+        cx, cy = x // span, y // span
+        return min(places, key=lambda p: abs(p[0] // span - cx) + abs(p[1] // span - cy))
+
+####
+
+class Level(object):
+    """A map ready to play: its grids and, if it fits into the view, its background."""
+
+    def __init__(self, index, smap, grid, center_grid):
+
+        self.index = index
+        self.map = smap
+        self.grid = grid
+        self.center_grid = center_grid
+        self.surface = None
+
+
+    @property
+    def world_size(self):
+        """Size of the drawn map including margins."""
+
+        return (2 * self.grid.xoff + self.map.width * self.grid.dx,
+                2 * self.grid.yoff + self.map.height * self.grid.dy)
+
+####
+
+class LevelCache(object):
+    """Levels prepared by a background thread, at most max_levels of them,
+    the least recently used is dropped first."""
+
+    def __init__(self, prepare, max_levels=3):
+
+        self.prepare = prepare
+        self.max_levels = max_levels
+        self.levels = collections.OrderedDict()
+        self.pending = set()
+        self.ready = threading.Condition()
+        self.wanted = queue.Queue()
+        self.thread = None
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, index):
+        """Prepared level index, None if it isn't there.
+        A level which is just being prepared is waited for."""
+
+        with self.ready:
+            while index in self.pending:
+                self.ready.wait()
+            level = self.levels.pop(index, None)
+            if level is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.levels[index] = level
+            return level
+
+
+    def prefetch(self, indexes, view):
+
+        if not self.max_levels:
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work)
+            self.thread.daemon = True
+            self.thread.start()
+        with self.ready:
+            for index in indexes:
+                if index not in self.levels and index not in self.pending:
+                    self.pending.add(index)
+                    self.wanted.put((index, view))
+
+
+    def work(self):
+
+        while True:
+            wanted = self.wanted.get()
+            if wanted is None:
+                return
+            level = None
+            try:
+                level = self.prepare(*wanted)
+            except Exception:
+                # get() misses, the main thread prepares the level itself and sees the error
+                pass
+            finally:
+                with self.ready:
+                    if level is not None:
+                        self.levels[level.index] = level
+                        while len(self.levels) > self.max_levels:
+                            self.levels.popitem(last=False)
+                    self.pending.discard(wanted[0])
+                    self.ready.notify_all()
+
+
+    def close(self):
+
+        if self.thread is not None:
+            self.wanted.put(None)
+            self.thread.join()
+            self.thread = None
 
 ####
 
 class Mapper(object):
     """Manage all maps."""
 
-    def __init__(self, maps, width, height):
+    def __init__(self, maps, width, height, tile_size=16, prefetch_levels=3):
 
         self.view_width = width
         self.view_height = height
-        self.maps = [Map(m) for m in maps]
+        self.tile_size = tile_size
+        # string lists become a Map when they are prepared
+        self.maps = list(maps)
+        self.levels = LevelCache(self.prepare, prefetch_levels)
+        self.next_random = None
+        self.prefetched = None
+        self.background_key = None
 
 
     def select(self, mode=START):
+        """Switch to another map, its level is taken from the cache if it is there."""
 
         assert mode in (START, UP, DOWN, RANDOM), "wrong selection"
 
         n = len(self.maps)
         if mode == START:
-            self.act_index = 0
+            index = 0
         elif mode == RANDOM:
+            index = self.act_index
             if len(self.maps) > 1:
-                self.act_index = rand.choice(list(set(xrange(n)) - set((self.act_index,))))
+                index = self.next_random
+                if index is None or index == self.act_index:
+                    index = rand.choice(list(set(xrange(n)) - set((self.act_index,))))
         else:
-            self.act_index = (self.act_index + n + mode) % len(self.maps)
+            index = (self.act_index + n + mode) % len(self.maps)
+
+        return self.load(index)
 
-        self.act_grid, self.act_center_grid = self.adjust_grids()
+
+    def load(self, index):
+        """Switch to map index."""
+
+        self.level = self.levels.get(index) or self.prepare(index)
+        self.act_index = index
+        self.act_grid, self.act_center_grid = self.level.grid, self.level.center_grid
+        if len(self.maps) > 1:
+            self.next_random = rand.choice(list(set(xrange(len(self.maps))) - set((index,))))
         return self.act_map, self.act_grid, self.act_center_grid
 
 
-    def adjust_grids(self):
+    def neighbours(self):
+        """Levels which may come next."""
+
+        n = len(self.maps)
+        return set(((self.act_index + 1) % n, (self.act_index - 1) % n,
+                    self.next_random)) - set((self.act_index, None))
+
+
+    def prepare(self, index, view=None):
+        """Make a level of map index, with a view also render its background
+        or, for a scrolling map, look at the cells around the start."""
+
+        smap = self.maps[index]
+        if not isinstance(smap, (Map, MazeMap)):
+            smap = self.maps[index] = Map(smap)
+        level = Level(index, smap, *self.adjust_grids(smap))
+
+        if view is not None:
+            if self.scrolls(level):
+                x, y = smap.start
+                dx, dy = view.width // level.grid.dx, view.height // level.grid.dy
+                for y in xrange(max(y - dy, 0), min(y + dy, smap.height)):
+                    smap.row(y, max(x - dx, 0), min(x + dx, smap.width))
+            else:
+                level.surface = self.render_map(view, level)
+        return level
+
+
+    def adjust_grids(self, smap):
         """There are 2 sorts of grids:
         a grid for the upper left Corner for drawing rectangles,
-        a grid for their center points, which are used for collision detection."""
+        a grid for their center points, which are used for collision detection.
+        Maps which would get tiles smaller than tile_size are drawn
+        with tile_size and scrolled."""
 
-        smap = self.act_map
         w = self.view_width // smap.width - 1
         h = self.view_height // smap.height - 1
-        xoff = self.view_width - smap.width * w
-        yoff = self.view_height - smap.height * h
+        if min(w, h) < self.tile_size:
+            w = h = self.tile_size
+            xoff = yoff = 0
+        else:
+            xoff = self.view_width - smap.width * w
+            yoff = self.view_height - smap.height * h
         grid = Grid(w, h, xoff//2, yoff//2)
         # +1 !
         center_grid = Grid(w, h, xoff//2 + w//2 + 1, yoff//2 + h//2 + 1)
@@ -330,17 +1079,75 @@ class Mapper(object):
         return grid, center_grid
 
 
-    def draw_map(self, view):
+    def draw_map(self, view, camera):
+        """The walls don't move, so a map fitting into the view is rendered into
+        the view's background once per level and window size.
+        Of a scrolling map only the cells in the view are drawn.
+        A new level starts preparing the levels which may come next."""
+
+        if self.prefetched is not self.level:
+            self.prefetched = self.level
+            self.levels.prefetch(self.neighbours(), view)
+
+        if self.scrolling:
+            if self.background_key is not None:
+                self.background_key = None
+                view.set_background(None)
+            grid = camera.view_grid(self.act_grid)
+            x0, y0, x1, y1 = grid.get_cell_range(0, 0, view.width, view.height)
+            smap = self.act_map
+            self.render_cells(view, smap, grid, max(x0, 0), max(y0, 0),
+                              min(x1, smap.width), min(y1, smap.height))
+            return
 
-        smap = self.act_map
-        grid = self.act_grid
-        width = smap.width
+        key = self.act_index, view.width, view.height
+        if key != self.background_key:
+            self.background_key = key
+            surface = self.level.surface
+            if surface is None or surface.get_size() != (view.width, view.height):
+                surface = self.level.surface = self.render_map(view, self.level)
+            view.set_background(surface)
 
-        for y in xrange(smap.height):
-            for x in xrange(width):
-                place = smap[x, y]
+
+    def render_map(self, view, level):
+
+        surface = view.new_background()
+        smap = level.map
+        self.render_cells(view, smap, level.grid, 0, 0, smap.width, smap.height, surface)
+        return surface
+
+
+    def render_cells(self, view, smap, grid, x0, y0, x1, y1, surface=None):
+        """Draw the cells from x0, y0 up to x1, y1 (exclusive)."""
+
+        for y in xrange(y0, y1):
+            for x, place in enumerate(smap.row(y, x0, x1), x0):
                 if place not in NOT_DRAWABLES:
-                    view.rectangle(grid.get_rect(x, y), mapcolors[place], place in PLACES)
+                    view.rectangle(grid.get_rect(x, y), mapcolors[place], place in PLACES, surface)
+
+
+    @property
+    def world_size(self):
+
+        return self.level.world_size
+
+
+    def scrolls(self, level):
+
+        width, height = level.world_size
+        return width > self.view_width or height > self.view_height
+
+
+    @property
+    def scrolling(self):
+
+        return self.scrolls(self.level)
+
+
+    def close(self):
+
+        self.levels.close()
+        print("Level prefetch: {} hits, {} misses".format(self.levels.hits, self.levels.misses))
 
 
     @property
@@ -377,6 +1184,142 @@ class Mapper(object):
 
   ####
 
+def slab(pos, size, move, lo, extent):
+    """Entry and exit time of the interval pos .. pos+size,
+    moving by move in time 1, through the interval lo .. lo+extent.
+    None if they never meet."""
+
+    if move > 0:
+        return (lo - pos - size) / move, (lo + extent - pos) / move
+    if move < 0:
+        return (lo + extent - pos) / move, (lo - pos - size) / move
+    if pos + size > lo and pos < lo + extent:
+        return -float('inf'), float('inf')
+    return None
+
+####
+
+def bounce_off_walls(pos, vel, size, lo, cell, cpos, csize, clo, ccell, walls_at):
+    """Along one axis: put agents which moved into a wall back in front of it
+    and reverse their velocity. The cross axis is tested at both sides of the agents,
+    so they must not be larger than a cell. walls_at takes axis and cross cells."""
+
+    edge = np.where(vel > 0, pos + size, pos)
+    a = np.floor((edge - lo) / cell).astype(np.intp)
+    hit = (walls_at(a, np.floor((cpos - clo) / ccell).astype(np.intp))
+           | walls_at(a, np.floor((cpos + csize - clo) / ccell).astype(np.intp)))
+    hit &= vel != 0
+    a = a[hit]
+    pos[hit] = np.where(vel[hit] > 0, lo + a * cell - size[hit] - SKIN, lo + (a + 1) * cell + SKIN)
+    vel[hit] *= -1
+
+####
+
+class Agents(object):
+    """Positions, velocities and sizes of many players, one row per player,
+    every field an array('d') (struct of arrays).
+    With numpy all rows are moved at once."""
+
+    fields = 'x', 'y', 'dx', 'dy', 'xold', 'yold', 'width', 'height'
+
+    def __init__(self):
+
+        for name in Agents.fields:
+            setattr(self, name, array('d'))
+
+
+    def __len__(self):
+
+        return len(self.x)
+
+
+    def add(self, x, y, width, height):
+        """Append a resting agent, return its row."""
+
+        for name, value in zip(Agents.fields, (x, y, 0, 0, x, y, width, height)):
+            getattr(self, name).append(value)
+        return len(self) - 1
+
+
+    def step(self, dt, decay, smap, grid):
+        """Move all agents by dt with velocities decaying by decay and bounce at the walls.
+        Substeps are short enough that no agent moves more than half a cell."""
+
+        if not len(self):
+            return
+        if np is None:
+            for row in xrange(len(self)):
+                self.step_row(row, dt, decay, smap, grid)
+            return
+
+        # views into the arrays, they must be gone before agents are added
+        x, y, dx, dy, xold, yold, width, height = [np.frombuffer(getattr(self, name))
+                                                   for name in Agents.fields]
+        xold[:] = x
+        yold[:] = y
+        left, top, cw, ch = grid.get_cell_box(0, 0)
+        walls_x = smap.walls_at
+        walls_y = lambda ys, xs: smap.walls_at(xs, ys)
+
+        speed = max(np.abs(dx).max(), np.abs(dy).max())
+        steps = max(1, int(math.ceil(speed * dt / (0.5 * min(cw, ch)))))
+        dt /= steps
+        decay **= 1.0 / steps
+        for _ in xrange(steps):
+            dx *= decay
+            dy *= decay
+            x += dx * dt
+            bounce_off_walls(x, dx, width, left, cw, y, height, top, ch, walls_x)
+            y += dy * dt
+            bounce_off_walls(y, dy, height, top, ch, x, width, left, cw, walls_y)
+
+
+    def step_row(self, row, dt, decay, smap, grid):
+        """Same as step for one agent without numpy."""
+
+        x, y, dx, dy = self.x[row], self.y[row], self.dx[row], self.dy[row]
+        width, height = self.width[row], self.height[row]
+        self.xold[row], self.yold[row] = x, y
+        left, top, cw, ch = grid.get_cell_box(0, 0)
+
+        steps = max(1, int(math.ceil(max(abs(dx), abs(dy)) * dt / (0.5 * min(cw, ch)))))
+        dt /= steps
+        decay **= 1.0 / steps
+        for _ in xrange(steps):
+            dx *= decay
+            dy *= decay
+            x += dx * dt
+            if dx:
+                cx = int(math.floor(((x + width if dx > 0 else x) - left) / cw))
+                if (smap.is_wall(cx, int(math.floor((y - top) / ch)))
+                    or smap.is_wall(cx, int(math.floor((y + height - top) / ch)))):
+                    x = left + cx * cw - width - SKIN if dx > 0 else left + (cx + 1) * cw + SKIN
+                    dx = -dx
+            y += dy * dt
+            if dy:
+                cy = int(math.floor(((y + height if dy > 0 else y) - top) / ch))
+                if (smap.is_wall(int(math.floor((x - left) / cw)), cy)
+                    or smap.is_wall(int(math.floor((x + width - left) / cw)), cy)):
+                    y = top + cy * ch - height - SKIN if dy > 0 else top + (cy + 1) * ch + SKIN
+                    dy = -dy
+
+        self.x[row], self.y[row], self.dx[row], self.dy[row] = x, y, dx, dy
+
+####
+
+def agent_field(name):
+    """Player attribute kept in the row of the player in its Agents."""
+
+    def get(player):
+        return getattr(player.agents, name)[player.row]
+
+    def set(player, value):
+        getattr(player.agents, name)[player.row] = value
+
+    return property(get, set)
+
+####
+
 class Player(object):
     """Representation of the moving player rectangle"""
 
@@ -387,17 +1330,22 @@ class Player(object):
 
     sensor_pts = ((0, 0), (1, 0), (1, 1), (0, 1))
 
-    def __init__(self, x, y, width, height, color):
+    x = agent_field('x')
+    y = agent_field('y')
+    dx = agent_field('dx')
+    dy = agent_field('dy')
+    xold = agent_field('xold')
+    yold = agent_field('yold')
+
+    def __init__(self, x, y, width, height, color, agents=None):
 
-        self.x = x
-        self.y = y
+        self.agents = Agents() if agents is None else agents
+        self.row = self.agents.add(x, y, width, height)
         self.width = width
         self.height = height
         self.width2 = width // 2
         self.height2 = height // 2
         self.color = color
-        self.dx = 0
-        self.dy = 0
 
 
     @property
@@ -485,9 +1433,44 @@ class Player(object):
         self.dy = (self.dy, -self.dy)[north_south]
 
 
-    def draw(self, view):
+    def draw(self, view, camera, alpha=1.0):
+        """Draw at alpha between the old and the new position."""
+
+        x, y = camera.to_screen(self.xold + alpha * (self.x - self.xold),
+                                self.yold + alpha * (self.y - self.yold))
+        view.rectangle((x, y, self.width, self.height), self.color)
+
+####
+
+class Camera(object):
+    """Window of the view onto the map"""
+
+    def __init__(self, width, height):
+
+        self.width = width
+        self.height = height
+        self.x = 0
+        self.y = 0
+
+
+    def follow(self, center, world_size):
+        """Center the window around a point, but not beyond the world borders."""
+
+        x, y = center
+        world_width, world_height = world_size
+        self.x = min(max(int(x) - self.width // 2, 0), max(world_width - self.width, 0))
+        self.y = min(max(int(y) - self.height // 2, 0), max(world_height - self.height, 0))
+
+
+    def to_screen(self, x, y):
 
-        view.rectangle((self.x, self.y, self.width, self.height), self.color)
+        return x - self.x, y - self.y
+
+
+    def view_grid(self, grid):
+        """Grid in screen coordinates"""
+
+        return grid.moved(-self.x, -self.y)
 
 ####
 
@@ -510,6 +1493,12 @@ class Controller(object):
             self.game.quit()
             return False
 
+        # the end screen has the player on the exit, no game to save
+        if event == 'save' and self.state == 'playing':
+            self.game.save()
+        elif event == 'load' and self.game.load():
+            self.state = 'playing'
+
         if self.state == 'playing':
             self.state = self.game.process(self.view, move_events)
             return True
@@ -535,22 +1524,38 @@ class MazeGame(object):
     def __init__(self, maps, config):
 
         self.config = config
-        self.dtimer = DeltaTimer(config.dt)
-        self.mapper = Mapper(maps, config.width, config.height)
+        self.dtimer = DeltaTimer(config.max_dt if config.swept or config.batch else config.dt,
+                                 config.max_substeps, config.leftover)
+        self.mapper = Mapper(maps, config.width, config.height, config.tile_size,
+                             config.prefetch_levels)
+        self.camera = Camera(config.width, config.height)
         self.player_accel= config.player_accel
         self.friction = config.friction
+        self.rewind = Rewind(config.rewind_frames)
+        self.saved = None
 
 
     def reset(self, mode):
 
         self.text = ""
+        if mode == START:
+            # a new game, don't rewind into the last one
+            self.rewind.clear()
         self.mapper.select(mode)
+        self.add_player()
+
+
+    def add_player(self):
+        """Put a new player on the start of the level."""
+
         x, y = self.mapper.get_point(*self.mapper.start)
         w, h =  self.mapper.player_sizehint
         size =  self.config.player_sizefac
         width = int(w * size)
         height = int(h * size)
-        self.player = Player(x+1, y+1, width, height, self.config.player_color)
+        # all players of a level, the first one is steered by the keys
+        self.agents = Agents()
+        self.player = Player(x+1, y+1, width, height, self.config.player_color, self.agents)
 
 
     def accelerate_player(self, events, accel):
@@ -561,7 +1566,7 @@ class MazeGame(object):
 
     def check_places(self):
 
-        place = self.mapper.act_map[self.mapper.get_cell(*self.player.center)]
+        place = self.mapper.act_map.kind(*self.mapper.get_cell(*self.player.center))
         if place in PLACES:
             if place == 'e':
                 return 'ending'
@@ -571,26 +1576,47 @@ class MazeGame(object):
         return 'playing'
 
 
+    def sensor_walls(self, x, y, dx, dy, n):
+        """Is there a wall under one of the sensors (x + i*dx, y + i*dy), i = 1 .. n-1?
+        The sensors of a side lie in one row or column of cells,
+        so they are tested as a single block of the wall grid."""
+
+        if n < 2:
+            return False
+
+        mapper = self.mapper
+        smap = mapper.act_map
+        grid = mapper.act_center_grid
+        if abs(dx) > grid.dx or abs(dy) > grid.dy:
+            # sensors are sparser than cells, don't test the gaps
+            return any(smap.is_wall(*mapper.get_cell(x + i * dx, y + i * dy))
+                       for i in xrange(1, n))
+
+        x0, y0 = mapper.get_cell(x + dx, y + dy)
+        x1, y1 = mapper.get_cell(x + (n - 1) * dx, y + (n - 1) * dy)
+        return smap.any_wall(x0, y0, x1, y1)
+
+
     def check_collision(self):
         """Check at first 4 sides of the player rectangle,
         if no collision occurs, check corners."""
 
         smap = self.mapper.act_map
         mapper = self.mapper
+        player = self.player
 
         ws = self.config.width_sensors
         hs = self.config.height_sensors
-        north = [smap[mapper.get_cell(sx, sy)] == 'x'
-                          for sx, sy in self.player.north_sensors(ws)]
-        south = [smap[mapper.get_cell(sx, sy)] == 'x'
-                          for sx, sy in self.player.south_sensors(ws)]
-        east = [smap[mapper.get_cell(sx, sy)] == 'x'
-                          for sx, sy in self.player.east_sensors(hs)]
-        west = [smap[mapper.get_cell(sx, sy)] == 'x'
-                        for sx, sy in self.player.west_sensors(hs)]
-
-        west_east = any(west) or any(east)
-        north_south = any(north) or any(south)
+        x, y = player.pos
+        dw = player.width // ws
+        dh = player.height // hs
+        north = self.sensor_walls(x, y, dw, 0, ws)
+        south = self.sensor_walls(x, y + player.height, dw, 0, ws)
+        west = self.sensor_walls(x, y, 0, dh, hs)
+        east = self.sensor_walls(x + player.width, y, 0, dh, hs)
+
+        west_east = west or east
+        north_south = north or south
 
         if west_east or north_south:
             self.player.bounce(west_east, north_south)
@@ -598,7 +1624,7 @@ class MazeGame(object):
 
         csx = False
         for sx, sy in self.player.vertex_sensors:
-            if smap[mapper.get_cell(sx, sy)] == 'x':
+            if smap.is_wall(*mapper.get_cell(sx, sy)):
                 csx, csy = sx, sy
                 break
 
@@ -620,17 +1646,144 @@ class MazeGame(object):
     def process(self, view, move_events):
         """Main method"""
 
-        dur = view.frame_duration_secs
         #self.text = str(view.frame_duration_secs)
+        state = 'playing'
+        if 'rewind' in move_events:
+            self.rewind.pop(self)
+        else:
+            self.update(view.frame_duration_secs, move_events)
+            # after a level change, so no snapshot lies on a place
+            state = self.check_places()
+            if state == 'playing':
+                self.rewind.push(self)
+
+        self.camera.follow(self.player.center, self.mapper.world_size)
+        self.mapper.draw_map(view, self.camera)
+        self.player.draw(view, self.camera, self.dtimer.alpha)
+        self.draw_text(view)
+
+        return state
+
+
+    def snapshot(self, buffer, offset=0):
+        """Pack everything changing while playing into buffer at offset."""
+
+        player = self.player
+        next_random = self.mapper.next_random
+        SNAPSHOT.pack_into(buffer, offset, self.mapper.act_index,
+                           -1 if next_random is None else next_random,
+                           player.x, player.y, player.dx, player.dy, player.xold, player.yold,
+                           self.dtimer.accu)
+
+
+    def restore(self, buffer, offset=0):
+        """Go back to a snapshot."""
+
+        index, next_random, x, y, dx, dy, xold, yold, accu = SNAPSHOT.unpack_from(buffer, offset)
+        if index != self.mapper.act_index:
+            self.mapper.load(index)
+            self.add_player()
+        self.mapper.next_random = None if next_random < 0 else next_random
+        player = self.player
+        player.x, player.y, player.dx, player.dy, player.xold, player.yold = x, y, dx, dy, xold, yold
+        self.dtimer.accu = accu
+
+
+    def save(self):
+
+        if self.saved is None:
+            self.saved = bytearray(SNAPSHOT.size)
+        self.snapshot(self.saved)
+
+
+    def load(self):
+        """Restore the saved game, False if there is none."""
+
+        if self.saved is None:
+            return False
+        self.restore(self.saved)
+        # also from the end screen
+        self.text = ""
+        return True
+
+
+    def update(self, dur, move_events):
+        """Advance the physics by the frame duration dur."""
+
         self.accelerate_player(move_events, dur * self.player_accel)
         self.dtimer += dur
-        self.dtimer.integrate(self.transform_player, self.friction)
+        if self.config.batch:
+            self.dtimer.split(self.step_agents, self.friction)
+        elif self.config.swept:
+            self.dtimer.split(self.sweep_player, self.friction)
+        else:
+            self.dtimer.integrate(self.transform_player, self.friction)
 
-        self.mapper.draw_map(view)
-        self.player.draw(view)
-        self.draw_text(view)
 
-        return self.check_places()
+    def step_agents(self, dt, friction):
+        """Move all players of the level in 1 timestep dt of any length."""
+
+        self.agents.step(dt, friction ** (dt / self.config.dt),
+                         self.mapper.act_map, self.mapper.act_center_grid)
+
+
+    def sweep(self, x, y, width, height, mx, my):
+        """Sweep the box x, y, width, height by mx, my against the walls.
+        Return the part of the way until the first impact (1 without impact)
+        and the new x, y positions at the walls which were hit (else None)."""
+
+        mapper = self.mapper
+        smap = mapper.act_map
+        grid = mapper.act_center_grid
+        c0, r0 = mapper.get_cell(min(x, x + mx), min(y, y + my))
+        c1, r1 = mapper.get_cell(max(x, x + mx) + width, max(y, y + my) + height)
+        c0, r0 = max(c0, 0), max(r0, 0)
+        c1, r1 = min(c1, smap.width - 1), min(r1, smap.height - 1)
+
+        toi, hit_x, hit_y = 1.0, None, None
+        for r in xrange(r0, r1 + 1):
+            for c in xrange(c0, c1 + 1):
+                if not smap.is_wall(c, r):
+                    continue
+                left, top, w, h = grid.get_cell_box(c, r)
+                tx = slab(x, width, mx, left, w)
+                ty = slab(y, height, my, top, h)
+                if tx is None or ty is None:
+                    continue
+                enter = max(tx[0], ty[0])
+                # boxes overlapping already are left alone, so the player can't get stuck
+                if enter < 0 or enter > toi or enter >= min(tx[1], ty[1]):
+                    continue
+                if enter < toi:
+                    toi, hit_x, hit_y = enter, None, None
+                if tx[0] >= ty[0]:
+                    hit_x = left - width - SKIN if mx > 0 else left + w + SKIN
+                if ty[0] >= tx[0]:
+                    hit_y = top - height - SKIN if my > 0 else top + h + SKIN
+
+        return toi, hit_x, hit_y
+
+
+    def sweep_player(self, dt, friction):
+        """Move player in 1 timestep dt of any length.
+        The player is swept along the whole way, so it can't tunnel through walls,
+        at an impact it bounces and moves on for the rest of dt."""
+
+        player = self.player
+        decay = friction ** (dt / self.config.dt)
+        player.dx *= decay
+        player.dy *= decay
+        player.xold, player.yold = player.pos
+
+        for _ in xrange(MAX_BOUNCES):
+            mx, my = player.dx * dt, player.dy * dt
+            toi, hit_x, hit_y = self.sweep(player.x, player.y, player.width, player.height, mx, my)
+            player.x = player.x + mx * toi if hit_x is None else hit_x
+            player.y = player.y + my * toi if hit_y is None else hit_y
+            if hit_x is None and hit_y is None:
+                break
+            player.bounce(hit_x is not None, hit_y is not None)
+            dt *= 1 - toi
 
 
     def transform_player(self, dt, friction):
@@ -657,30 +1810,122 @@ class MazeGame(object):
 
     def quit(self):
 
+        self.mapper.close()
+        print("Timestep:", self.dtimer.report())
         print("Bye")
 
 ####
 
+class Rewind(object):
+    """The last capacity snapshots of a game in a ring buffer allocated at once."""
+
+    def __init__(self, capacity):
+
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * SNAPSHOT.size)
+        # next slot to write
+        self.top = 0
+        self.count = 0
+
+
+    def push(self, game):
+
+        game.snapshot(self.buffer, self.top * SNAPSHOT.size)
+        self.top = (self.top + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+
+    def pop(self, game):
+        """Restore the last snapshot, False if there is none."""
+
+        if not self.count:
+            return False
+        self.top = (self.top - 1) % self.capacity
+        self.count -= 1
+        game.restore(self.buffer, self.top * SNAPSHOT.size)
+        return True
+
+
+    def clear(self):
+
+        self.top = 0
+        self.count = 0
+
+####
+
 class DeltaTimer(object):
-    """Timing control"""
+    """Timing control
+
+    A frame makes at most max_steps steps, so a long frame can't make the next ones
+    longer and longer. The whole steps left over are handled by the leftover policy:
+    'drop' throws them away, so the game falls behind the clock,
+    'carry' keeps them and catches up in the next frames."""
+
+    LEFTOVERS = 'drop', 'carry'
 
-    def __init__(self, dt):
+    def __init__(self, dt, max_steps=10, leftover='drop'):
 
+        assert leftover in DeltaTimer.LEFTOVERS, "unknown leftover policy"
         self.dt = dt
         self.accu = 0.0
+        self.max_steps = max_steps
+        self.leftover = leftover
+        # part of a step between the last state and the next one, for drawing
+        self.alpha = 0.0
+        self.frames = 0
+        self.steps = 0
+        self.clamped = 0.0
+        self.worst_frame = 0.0
+        self.worst_steps = 0
 
 
     def __iadd__(self, delta):
 
         self.accu += delta
+        self.frames += 1
+        self.worst_frame = max(self.worst_frame, delta)
         return self
 
 
     def integrate(self, func, *args):
         """For a fixed timestep dt, adjust movement to fps."""
-        while self.accu >= self.dt:
+        steps = 0
+        while self.accu >= self.dt and steps < self.max_steps:
             func(self.dt, *args)
             self.accu -= self.dt
+            steps += 1
+        self.limit(steps)
+        self.alpha = min(self.accu / self.dt, 1.0)
+
+
+    def split(self, func, *args):
+        """Execute func for all accumulated time, in equal steps of at most dt."""
+        steps = min(int(math.ceil(self.accu / self.dt)), self.max_steps)
+        if steps:
+            step = min(self.accu / steps, self.dt)
+            for _ in xrange(steps):
+                func(step, *args)
+            self.accu -= steps * step
+        self.limit(steps)
+        self.alpha = 1.0
+
+
+    def limit(self, steps):
+        """Count the steps of a frame, apply the leftover policy to what they left."""
+
+        self.steps += steps
+        self.worst_steps = max(self.worst_steps, steps)
+        if self.accu >= self.dt and self.leftover == 'drop':
+            # keep the part of a step for alpha
+            keep = self.accu - self.dt * int(self.accu / self.dt)
+            self.clamped += self.accu - keep
+            self.accu = keep
+
+
+    def report(self):
+
+        return ("{} steps in {} frames, worst frame {:.1f} ms with {} steps, {:.2f} secs clamped".format(
+            self.steps, self.frames, 1000 * self.worst_frame, self.worst_steps, self.clamped))
 
 ####
 
@@ -693,12 +1938,263 @@ class Config(object):
 
 ####
 
-def main():
+def benchmark_collision(frames=3000, fps=30, accel=12000):
+    """Substeps per frame, cpu time and tunneling of sensor and swept collision,
+    for a player steered at random without drawing."""
+
+    small_dt = 0.002
+    variants = (('sensors dt={}'.format(config['dt']), {'swept': False}),
+                ('sensors dt={}'.format(small_dt),
+                 {'swept': False, 'dt': small_dt, 'max_substeps': 100,
+                  'friction': config['friction'] ** (small_dt / config['dt'])}),
+                ('swept max_dt={}'.format(config['max_dt']), {'swept': True}))
+
+    for name, options in variants:
+        rand.seed(1)
+        game = MazeGame(maps, Config(**dict(config, player_accel=accel, **options)))
+        game.reset(START)
+        step = ('transform_player', 'sweep_player')[game.config.swept]
+        substeps = [0]
+        def counted(func):
+            def count(*args):
+                substeps[0] += 1
+                func(*args)
+            return count
+        setattr(game, step, counted(getattr(game, step)))
+
+        tunneled = 0
+        start = cpu_time()
+        for frame in xrange(frames):
+            if frame % 20 == 0:
+                move_events = rand.sample(sorted(Player.dirs), 2)
+            game.update(1.0 / fps, move_events)
+            mapper = game.mapper
+            tunneled += mapper.act_map.is_wall(*mapper.get_cell(*game.player.center))
+            if game.check_places() == 'ending':
+                game.reset(START)
+        secs = cpu_time() - start
+        print("{:20s}: {:6.2f} substeps/frame, {:7.1f} us/frame, {:5d} frames in walls".format(
+            name, substeps[0] / float(frames), 1e6 * secs / frames, tunneled))
+
+####
+
+def benchmark_maze(cells=512, chunk=config['maze_chunk']):
+    """Generation speed of MazeMap and start time of a huge maze level."""
+
+    smap = MazeMap(cells, cells, seed=1, chunk=chunk)
+    start = cpu_time()
+    for cy in xrange(0, cells, chunk):
+        for cx in xrange(0, cells, chunk):
+            smap.get_chunk(cx // chunk, cy // chunk)
+    secs = cpu_time() - start
+    tiles = sum(len(tiles) for tiles, stride in smap.chunks.values())
+    print("{0}x{0} cells: {1:.0f} cells/sec, {2:.2f} bytes/cell".format(
+        cells, cells * cells / secs, tiles / float(cells * cells)))
+
+    start = cpu_time()
+    width, height = config['maze_cells']
+    game = MazeGame([MazeMap(width, height, seed=1, chunk=chunk)], Config(**config))
+    game.reset(START)
+    game.update(0.01, ['right'])
+    print("{}x{} cells: started in {:.3f} secs, {} chunks generated".format(
+        width, height, cpu_time() - start, len(game.mapper.act_map.chunks)))
+
+####
+
+def benchmark_paths(agents=1000, frames=100):
+    """Next step queries of agents walking to the exit of hard_map and a huge maze."""
+
+    rand.seed(1)
+    width, height = config['maze_cells']
+    for name, smap in (('hard_map', Map(hard_map)),
+                       ('{}x{} maze'.format(width, height), MazeMap(width, height, seed=1))):
+        paths = PathFinder()
+        floor = [(x, y) for y in xrange(min(smap.height, 200)) for x in xrange(min(smap.width, 200))
+                 if not smap.is_wall(x, y)]
+        walkers = [rand.choice(floor) for _ in xrange(agents)]
+        queries = 0
+        start = cpu_time()
+        for frame in xrange(frames):
+            for i, (x, y) in enumerate(walkers):
+                walkers[i] = paths.next_step(smap, x, y, 'e') or (x, y)
+            queries += agents
+        secs = cpu_time() - start
+        print("{:16s}: {:9.0f} queries/sec, {} fields built, {} cache hits".format(
+            name, queries / secs, paths.misses, paths.hits))
+
+####
+
+def benchmark_agents(counts=(1, 10, 100, 1000, 10000), steps=20, dt=0.02):
+    """Time of a physics step for many players on hard_map:
+    one Agents step against sweeping every player on its own."""
+
+    game = MazeGame([hard_map], Config(**config))
+    mapper = game.mapper
+    rand.seed(1)
+    for n in counts:
+        game.reset(START)
+        agents = game.agents
+        player = game.player
+        floor = [(x, y) for y in xrange(mapper.act_map.height) for x in xrange(mapper.act_map.width)
+                 if mapper.act_map.kind(x, y) == '.']
+        players = [player]
+        for _ in xrange(n - 1):
+            x, y = mapper.get_point(*rand.choice(floor))
+            players.append(Player(x + 1, y + 1, player.width, player.height, player.color, agents))
+        for p in players:
+            p.dx, p.dy = rand.uniform(-300, 300), rand.uniform(-300, 300)
+
+        start = cpu_time()
+        for _ in xrange(steps):
+            game.step_agents(dt, game.friction)
+        batched = (cpu_time() - start) / steps
+
+        start = cpu_time()
+        for _ in xrange(steps):
+            for p in players:
+                game.player = p
+                game.sweep_player(dt, game.friction)
+        single = (cpu_time() - start) / steps
+
+        print("{:6d} players: {:9.3f} ms/step batched ({}), {:9.3f} ms/step one by one".format(
+            n, 1000 * batched, 'numpy' if np else 'python', 1000 * single))
+
+####
+
+def benchmark_levels(cells=2000, levels=4, transitions=8, play_secs=0.5):
+    """Time of level transitions between large maps with and without prefetching."""
+
+    rand.seed(1)
+    maps = []
+    for _ in xrange(levels):
+        rows = [''.join(rand.choice('xx..............u.d.r') for _ in xrange(cells)) for _ in xrange(cells)]
+        rows[1] = 's' + rows[1][1:]
+        maps.append(rows)
+
+    for prefetch_levels in 0, 3:
+        mapper = Mapper(maps, config['width'], config['height'], config['tile_size'], prefetch_levels)
+        mapper.select(START)
+        slowest = total = 0
+        for _ in xrange(transitions):
+            mapper.levels.prefetch(mapper.neighbours(), None)
+            time.sleep(play_secs)
+            start = time.time()
+            mapper.select(rand.choice((UP, DOWN, RANDOM)))
+            secs = time.time() - start
+            slowest = max(slowest, secs)
+            total += secs
+        mapper.close()
+        print("prefetch {}: {:8.2f} ms/transition, slowest {:8.2f} ms".format(
+            prefetch_levels, 1000 * total / transitions, 1000 * slowest))
+
+####
+
+def benchmark_snapshots(rounds=100000):
+    """Size and time of a snapshot in the rewind buffer against pickling the player."""
+
+    game = MazeGame(maps, Config(**config))
+    game.reset(START)
+    game.update(0.1, ['right', 'down'])
+    rewind = game.rewind
+    print("{} bytes/snapshot, {} bytes for {} snapshots".format(
+        SNAPSHOT.size, len(rewind.buffer), rewind.capacity))
+
+    start = time.time()
+    for _ in xrange(rounds):
+        rewind.push(game)
+    push = (time.time() - start) / rounds
+    start = time.time()
+    for _ in xrange(rounds):
+        rewind.pop(game)
+        # keep the buffer full
+        rewind.count += 1
+    pop = (time.time() - start) / rounds
+    print("snapshot: {:6.2f} us save, {:6.2f} us restore".format(1e6 * push, 1e6 * pop))
+
+    start = time.time()
+    for _ in xrange(rounds // 10):
+        data = pickle.dumps(game.player, pickle.HIGHEST_PROTOCOL)
+    dump = (time.time() - start) / (rounds // 10)
+    start = time.time()
+    for _ in xrange(rounds // 10):
+        pickle.loads(data)
+    load = (time.time() - start) / (rounds // 10)
+    print("pickled player: {} bytes, {:6.2f} us save, {:6.2f} us restore".format(
+        len(data), 1e6 * dump, 1e6 * load))
+
+####
+
+def benchmark_events(frames=2000, flood=3, every=20):
+    """Frames from a control key press to its event, while other keys
+    (flood per frame) and mouse motions keep coming, and time of get_events."""
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    view = PygView(None, Config(**config))
+    pressed = []
+    latencies = []
+    secs = 0
+    for frame in xrange(frames):
+        for _ in xrange(flood):
+            pyg.event.post(pyg.event.Event(pyg.KEYDOWN, key=pyg.K_a, mod=0, unicode='a', scancode=0))
+            pyg.event.post(pyg.event.Event(pyg.MOUSEMOTION, pos=(0, 0), rel=(1, 1), buttons=(0, 0, 0)))
+        if frame % every == 0:
+            pyg.event.post(pyg.event.Event(pyg.KEYDOWN, key=pyg.K_F5, mod=0, unicode='', scancode=0))
+            pressed.append(frame)
+        start = time.time()
+        event, _ = view.get_events()
+        secs += time.time() - start
+        if event == 'save':
+            latencies.append(frame - pressed.pop(0))
+    pyg.quit()
+
+    print("{} of {} presses seen, latency {:.1f} frames mean, {} max ({:.0f} ms at {} fps), "
+          "get_events {:.1f} us".format(
+              len(latencies), len(latencies) + len(pressed),
+              sum(latencies) / max(len(latencies), 1), max(latencies or [0]),
+              1000.0 * max(latencies or [0]) / config['fps'], config['fps'], 1e6 * secs / frames))
+
+####
+
+BENCHMARKS = {'collision': benchmark_collision,
+              'maze': benchmark_maze,
+              'paths': benchmark_paths,
+              'agents': benchmark_agents,
+              'levels': benchmark_levels,
+              'snapshots': benchmark_snapshots,
+              'events': benchmark_events}
+
+####
+
+def main(maps=maps, view=PygView, **options):
+
+    Controller(view, maps, Config(**dict(config, **options))).run()
+
+####
+
+def maze_maps(seed):
+    """The built in maps for seed -1, else one huge maze."""
 
-    Controller(PygView, maps, Config(**config)).run()
+    if seed < 0:
+        return maps
+    width, height = config['maze_cells']
+    return [MazeMap(width, height, seed, config['maze_chunk'])]
 
 ####
 
 if __name__ == '__main__':
 
-    main()
+    args = sys.argv[1:]
+    if args[:1] == ['bench']:
+        BENCHMARKS[args[1]]()
+    elif args[:1] == ['replay']:
+        main(maze_maps(Recording.load(args[1])[1]), ReplayView, replay=args[1])
+    else:
+        options = {}
+        if 'record' in args:
+            i = args.index('record')
+            options = {'view': RecordingView, 'record': args[i + 1]}
+            del args[i:i + 2]
+        seed = -1
+        if args[:1] == ['maze']:
+            seed = int(args[1]) if len(args) > 1 else rand.randrange(1 << 32)
+        main(maze_maps(seed), maze_seed=seed, **options)